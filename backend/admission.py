@@ -0,0 +1,208 @@
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+import pdf2image
+from metrics import QUEUE_DEPTH, LANE_ACTIVE, RESOURCE_IN_USE, REJECTIONS
+
+# Lane priorities: lower numbers are served first when OCR/LLM slots are contended
+SMALL_LANE = 'small'
+LARGE_LANE = 'large'
+LANE_PRIORITY = {SMALL_LANE: 0, LARGE_LANE: 1}
+
+_current = threading.local()
+
+
+def _per_process(name, default, minimum=1):
+    """Host-wide limit from the environment, split evenly across the WEB_CONCURRENCY worker processes"""
+    processes = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+    return max(minimum, int(os.getenv(name, default)) // processes)
+
+
+def lane_limits():
+    """(workers, queue size) of each lane in one worker process"""
+    return {
+        SMALL_LANE: (_per_process('SMALL_LANE_WORKERS', 4), _per_process('SMALL_LANE_QUEUE', 16, minimum=0)),
+        LARGE_LANE: (_per_process('LARGE_LANE_WORKERS', 1), _per_process('LARGE_LANE_QUEUE', 4, minimum=0)),
+    }
+
+
+def lane_capacity():
+    """Uploads one worker process admits at once, running or queued; each needs its own request thread"""
+    return sum(workers + queue_size for workers, queue_size in lane_limits().values())
+
+
+class QueueFull(Exception):
+    """Raised when a lane cannot accept more work; the upload should be retried later"""
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"The {lane} upload queue is full. Retry in {retry_after} seconds.")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def count_pdf_pages(source):
+    """Page count from pdfinfo for a PDF path or raw bytes, or None if it cannot be read"""
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            info = pdf2image.pdfinfo_from_bytes(bytes(source), timeout=10)
+        else:
+            info = pdf2image.pdfinfo_from_path(source, timeout=10)
+        return int(info['Pages'])
+    except Exception:
+        return None
+
+
+class Lane:
+    """Bounded worker pool with a bounded wait queue for one class of uploads"""
+
+    def __init__(self, name, workers, queue_size, queue_timeout):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        # Moving average of how long one upload holds a slot, for Retry-After
+        self._avg_service_time = 5.0
+        QUEUE_DEPTH.set(0, lane=name)
+        LANE_ACTIVE.set(0, lane=name)
+
+    def retry_after(self):
+        backlog = (self._waiting + self._active) / max(1, self.workers)
+        return max(1, math.ceil(backlog * self._avg_service_time))
+
+    def _reject(self):
+        REJECTIONS.inc(lane=self.name)
+        raise QueueFull(self.name, self.retry_after())
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            if self._waiting + self._active >= self.workers + self.queue_size:
+                self._reject()
+            self._waiting += 1
+            QUEUE_DEPTH.set(self._waiting, lane=self.name)
+
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            QUEUE_DEPTH.set(self._waiting, lane=self.name)
+            if not acquired:
+                self._reject()
+            self._active += 1
+            LANE_ACTIVE.set(self._active, lane=self.name)
+
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._active -= 1
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
+                LANE_ACTIVE.set(self._active, lane=self.name)
+            self._slots.release()
+
+
+class PrioritySlots:
+    """Counting semaphore that hands free slots to the highest-priority waiter first"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self._in_use = 0
+        self._waiting = {}
+        self._cond = threading.Condition()
+        RESOURCE_IN_USE.set(0, resource=name)
+
+    def _has_priority(self, priority):
+        return not any(count for p, count in self._waiting.items() if p < priority)
+
+    @contextmanager
+    def slot(self, priority=0):
+        with self._cond:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                self._cond.wait_for(lambda: self._in_use < self.capacity and self._has_priority(priority))
+            finally:
+                self._waiting[priority] -= 1
+            self._in_use += 1
+            RESOURCE_IN_USE.set(self._in_use, resource=self.name)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_use -= 1
+                RESOURCE_IN_USE.set(self._in_use, resource=self.name)
+                self._cond.notify_all()
+
+
+class AdmissionController:
+    """Admission control in front of the report pipeline.
+
+    Each upload is routed to a lane by size (bytes, or page count for PDFs)
+    so a burst of large PDFs cannot starve small phone photos. Within the
+    pipeline, OCR and LLM calls share capped pools that serve the small lane
+    first. A full lane raises QueueFull, which the API turns into a 429.
+
+    Every worker process has its own controller, so the slot and queue
+    limits are host-wide totals divided by WEB_CONCURRENCY (at least one
+    slot per process).
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = (os.getenv('ADMISSION_CONTROL', '1') != '0') if enabled is None else enabled
+        self.large_upload_bytes = int(os.getenv('LARGE_UPLOAD_BYTES', 5 * 1024 * 1024))
+        self.large_pdf_pages = int(os.getenv('LARGE_PDF_PAGES', 3))
+        queue_timeout = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 30))
+        self.lanes = {name: Lane(name, workers, queue_size, queue_timeout)
+                      for name, (workers, queue_size) in lane_limits().items()}
+        self.ocr = PrioritySlots('ocr', _per_process('MAX_CONCURRENT_OCR', os.cpu_count() or 2))
+        self.llm = PrioritySlots('llm', _per_process('MAX_CONCURRENT_LLM', 4))
+
+    def choose_lane(self, filename, size, pages=None):
+        """Pick a lane from the upload size and, for PDFs, the page count.
+
+        pages comes from count_pdf_pages. PDFs whose page count could not be
+        read go to the large lane.
+        """
+        if size >= self.large_upload_bytes:
+            return LARGE_LANE
+        if filename.lower().endswith('.pdf'):
+            if pages is None or pages > self.large_pdf_pages:
+                return LARGE_LANE
+        return SMALL_LANE
+
+    @contextmanager
+    def admit(self, lane):
+        if not self.enabled:
+            yield
+            return
+        with self.lanes[lane].admit():
+            _current.priority = LANE_PRIORITY[lane]
+            try:
+                yield
+            finally:
+                _current.priority = 0
+
+    @contextmanager
+    def ocr_slot(self):
+        """Hold one of the MAX_CONCURRENT_OCR slots for the enclosed Tesseract call"""
+        if not self.enabled:
+            yield
+            return
+        with self.ocr.slot(getattr(_current, 'priority', 0)):
+            yield
+
+    @contextmanager
+    def llm_slot(self):
+        """Hold one of the MAX_CONCURRENT_LLM slots for the enclosed LLM call"""
+        if not self.enabled:
+            yield
+            return
+        with self.llm.slot(getattr(_current, 'priority', 0)):
+            yield
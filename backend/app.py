@@ -1,20 +1,59 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import pytesseract
 from PIL import Image
 import pdf2image
+import io
 import os
 import tempfile
 import re
 from openai import OpenAI
 import json
+import time
 from rag_system import MedicalRAGSystem
+from medical_knowledge import classify_value
+from phrase_catalog import get_catalog
+from prompt_builder import build_prompt, MODEL_NAME, MAX_OUTPUT_TOKENS
 from database import MySQLDatabase
+from offline_store import OfflineFirstDatabase
+from admission import AdmissionController, QueueFull, count_pdf_pages
+from near_duplicate import NearDuplicateIndex, image_hash, format_hash, headers_agree, values_agree
+from metrics import registry, profiler, REQUEST_LATENCY, STAGE_LATENCY, OCR_PAGE_LATENCY, PROMPT_TOKENS, EVENTS
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Uploads up to UPLOAD_SPOOL_BYTES stay in memory; larger ones spill to an anonymous temp file
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 25 * 1024 * 1024))
+# Size of the downscaled copy used for near-duplicate hashing and its confirming OCR pass
+PREVIEW_WIDTH = 1200
+PREVIEW_PDF_DPI = 150
+
+class UploadRequest(Request):
+    """Request that buffers uploaded images in memory instead of Werkzeug's 500KB disk cutoff.
+    
+    pdftoppm can only read from a path, so PDFs stream straight into a named
+    temp file that is rendered in place instead of being copied again.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and filename.lower().endswith('.pdf'):
+            return tempfile.NamedTemporaryFile(suffix='.pdf')
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+def staged_path(source):
+    """Path of an upload stream that already lives in a named file on disk, else None"""
+    name = getattr(source, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        source.flush()
+        return name
+    return None
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Werkzeug enforces this while the body streams in, before the whole upload is buffered
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 CORS(app)
 
 # Configure OpenAI
@@ -22,7 +61,14 @@ client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 # Initialize RAG system and database
 rag_system = MedicalRAGSystem()
-db = MySQLDatabase()
+# STORAGE_BACKEND=offline keeps reports in local SQLite and syncs them to MySQL when the uplink is up
+db = OfflineFirstDatabase() if os.getenv('STORAGE_BACKEND', 'mysql') == 'offline' else MySQLDatabase()
+
+# Caps concurrent OCR/LLM work and keeps large PDFs out of the small-upload lane
+admission = AdmissionController()
+
+# Perceptual hashes of past uploads, so re-photographed reports skip OCR and the LLM
+duplicates = NearDuplicateIndex(db)
 
 class MedicalReportProcessor:
     def __init__(self):
@@ -34,32 +80,111 @@ class MedicalReportProcessor:
             "creatinine": {"normal_range": "0.6-1.2 mg/dL", "description": "Kidney function marker"}
         }
     
+    def _open_image(self, source):
+        """Open an image from a path, raw bytes or a file-like object"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        elif hasattr(source, 'seek'):
+            source.seek(0)
+        return Image.open(source)
+
+    def _render_pdf(self, source, dpi=300, **kwargs):
+        """Render PDF pages from a path, raw bytes or a file-like object"""
+        if isinstance(source, (str, os.PathLike)):
+            return pdf2image.convert_from_path(source, dpi=dpi, **kwargs)
+        path = staged_path(source)
+        if path:
+            return pdf2image.convert_from_path(path, dpi=dpi, **kwargs)
+        if hasattr(source, 'read'):
+            source.seek(0)
+            source = source.read()
+        return pdf2image.convert_from_bytes(bytes(source), dpi=dpi, **kwargs)
+
+    def _preview_image(self, source, is_pdf=False):
+        """Downscaled grayscale copy of an upload (first page for PDFs)"""
+        if is_pdf:
+            image = self._render_pdf(source, dpi=PREVIEW_PDF_DPI, first_page=1, last_page=1)[0]
+        else:
+            image = self._open_image(source)
+            # Lets JPEG decode straight to a reduced size
+            image.draft('L', (PREVIEW_WIDTH, PREVIEW_WIDTH * 2))
+        image = image.convert('L')
+        image.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH * 2))
+        return image
+
+    def find_near_duplicate(self, source, is_pdf=False):
+        """Look for an earlier upload of the same report.
+
+        Returns (upload_hash, previous_report, match) where previous_report and
+        match are None unless a stored report can be reused.
+        """
+        try:
+            with STAGE_LATENCY.time(stage='near_duplicate'):
+                preview = self._preview_image(source, is_pdf)
+                upload_hash = image_hash(preview)
+                if upload_hash is None:
+                    return None, None, None
+                candidates = duplicates.lookup(upload_hash)
+                if not candidates:
+                    return upload_hash, None, None
+                if not duplicates.confirmable(candidates):
+                    # Too many same-template reports this close; a quick OCR pass would rarely pay off
+                    EVENTS.inc(event='near_duplicate_ambiguous')
+                    return upload_hash, None, None
+                
+                # Confirm the patient header and values with a quick OCR pass
+                with admission.ocr_slot(), OCR_PAGE_LATENCY.time(source='preview'):
+                    text = pytesseract.image_to_string(preview, config='--psm 6')
+                found = self._parse_lab_values(text)
+                
+                for report_id, distance in candidates:
+                    previous = db.get_report(report_id)
+                    if (previous and headers_agree(text, previous['extracted_text'])
+                            and values_agree(found, previous['lab_values'])):
+                        return upload_hash, previous, {'report_id': report_id, 'distance': distance}
+                EVENTS.inc(event='near_duplicate_rejected')
+                return upload_hash, None, None
+        except Exception as e:
+            print(f"Error checking for near-duplicates: {e}")
+            return None, None, None
+    
     def extract_text_from_image(self, image_path):
-        """Extract text from image using OCR"""
+        """Extract text from image using OCR. Accepts a path, bytes or file-like object."""
         try:
-            image = Image.open(image_path)
-            # Enhance image for better OCR
-            image = image.convert('RGB')
-            text = pytesseract.image_to_string(image, config='--psm 6')
+            with STAGE_LATENCY.time(stage='ocr'):
+                image = self._open_image(image_path)
+                # Enhance image for better OCR
+                image = image.convert('RGB')
+                with admission.ocr_slot(), OCR_PAGE_LATENCY.time(source='image'):
+                    text = pytesseract.image_to_string(image, config='--psm 6')
             return text
         except Exception as e:
+            EVENTS.inc(event='ocr_error')
             return f"Error extracting text: {str(e)}"
     
     def extract_text_from_pdf(self, pdf_path):
-        """Extract text from PDF using OCR"""
+        """Extract text from PDF using OCR. Accepts a path, bytes or file-like object."""
         try:
-            pages = pdf2image.convert_from_path(pdf_path, dpi=300)
+            with STAGE_LATENCY.time(stage='pdf_render'):
+                pages = self._render_pdf(pdf_path, dpi=300)
             text = ""
-            for page in pages:
-                # Enhance image for better OCR
-                page = page.convert('RGB')
-                text += pytesseract.image_to_string(page, config='--psm 6') + "\n"
+            with STAGE_LATENCY.time(stage='ocr'):
+                for page in pages:
+                    # Enhance image for better OCR
+                    page = page.convert('RGB')
+                    with admission.ocr_slot(), OCR_PAGE_LATENCY.time(source='pdf_page'):
+                        text += pytesseract.image_to_string(page, config='--psm 6') + "\n"
             return text
         except Exception as e:
+            EVENTS.inc(event='ocr_error')
             return f"Error extracting text from PDF: {str(e)}"
     
     def parse_lab_values(self, text):
         """Parse lab values from extracted text"""
+        with STAGE_LATENCY.time(stage='parse'):
+            return self._parse_lab_values(text)
+
+    def _parse_lab_values(self, text):
         values = {}
         
         # Enhanced patterns for lab values and medical conditions
@@ -93,78 +218,88 @@ class MedicalReportProcessor:
         
         return values
     
-    def generate_explanation_with_rag(self, lab_values, extracted_text):
+    def generate_explanation_with_rag(self, lab_values, extracted_text, lang='en'):
         """Generate explanation using RAG system"""
+        catalog = get_catalog()
+        lang = catalog.resolve_language(lang)
+        if lang != catalog.default_language:
+            # Localized text is assembled from the precompiled catalog instead of another LLM round trip
+            with STAGE_LATENCY.time(stage='localize'):
+                return self._templated_explanation(lab_values, lang)
+        
         try:
+            rag_context = []
             if rag_system:
-                rag_context = rag_system.generate_rag_context(lab_values, extracted_text)
-                context_str = "\n".join([f"- {item['test']}: {item['description']}. Normal: {item['normal_range']}. Tips: {item['lifestyle_tips']}" for item in rag_context])
-            else:
-                context_str = "Basic medical knowledge available."
-            
-            prompt = f"""
-            You are a medical assistant helping rural patients understand their lab reports.
-            
-            MEDICAL CONTEXT FROM KNOWLEDGE BASE:
-            {context_str}
-            
-            PATIENT'S LAB VALUES: {json.dumps(lab_values)}
-            REPORT TEXT: {extracted_text[:800]}
+                with STAGE_LATENCY.time(stage='rag'):
+                    rag_context = rag_system.generate_rag_context(lab_values, extracted_text)
             
-            Provide a simple explanation using the medical context above:
-            1. Explain each test in simple terms
-            2. Compare values to normal ranges
-            3. Provide lifestyle suggestions (NO diagnosis/medication)
-            4. Use simple language for rural patients
-            5. Assess overall risk level as "Low", "Medium", or "High" based on the values.
-            
-            Return JSON: {{"summary": "", "test_explanations": {{}}, "lifestyle_tips": [], "when_to_see_doctor": "", "risk_level": "Low/Medium/High"}}
-            """
+            # Fit values, knowledge-base context and report lines into the input token budget
+            with STAGE_LATENCY.time(stage='prompt_build'):
+                prompt, prompt_stats = build_prompt(lab_values, extracted_text, rag_context, max_tokens=MAX_OUTPUT_TOKENS)
+            PROMPT_TOKENS.observe(prompt_stats['prompt_tokens'])
             
             if client:
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=1000
-                )
+                with admission.llm_slot(), STAGE_LATENCY.time(stage='llm'):
+                    response = client.chat.completions.create(
+                        model=MODEL_NAME,
+                        messages=[{"role": "user", "content": prompt}],
+                        max_tokens=MAX_OUTPUT_TOKENS
+                    )
                 return json.loads(response.choices[0].message.content)
             else:
                 return self._fallback_explanation(lab_values)
                 
         except Exception as e:
+            EVENTS.inc(event='llm_error')
             return self._fallback_explanation(lab_values)
     
-    def _fallback_explanation(self, lab_values):
+    def _fallback_explanation(self, lab_values, lang='en'):
+        EVENTS.inc(event='llm_fallback')
+        return self._templated_explanation(lab_values, lang)
+    
+    def _templated_explanation(self, lab_values, lang='en'):
+        """Build an explanation from the phrase catalog, without calling the LLM"""
+        catalog = get_catalog()
         # Enhanced fallback for medical conditions
         risk_level = "Low"
         if 'hypertension' in lab_values:
-            summary = "Medical report shows hypertension (high blood pressure) and related symptoms."
-            tips = [
-                "Reduce salt intake in your diet",
-                "Exercise regularly as advised by your doctor", 
-                "Take prescribed blood pressure medication",
-                "Monitor your blood pressure regularly"
-            ]
+            summary = catalog.get('summary.hypertension', lang)
+            tips = catalog.get('tips.hypertension', lang)
             risk_level = "High"
         elif any(condition in lab_values for condition in ['chest_pain', 'palpitations', 'shortness_of_breath']):
-            summary = "Medical report shows cardiovascular symptoms that need attention."
-            tips = [
-                "Avoid strenuous activities until cleared by doctor",
-                "Eat heart-healthy foods",
-                "Stay hydrated and get adequate rest"
-            ]
+            summary = catalog.get('summary.cardiac', lang)
+            tips = catalog.get('tips.cardiac', lang)
             risk_level = "Medium"
         else:
-            summary = f"Found {len(lab_values)} medical findings in your report."
-            tips = ["Maintain a healthy diet", "Exercise regularly", "Stay hydrated"]
+            summary = catalog.get('summary.findings', lang, count=len(lab_values))
+            tips = catalog.get('tips.general', lang)
             if len(lab_values) > 3:
                 risk_level = "Medium"
-            
+        
+        test_explanations = {}
+        out_of_range = False
+        for test, value in lab_values.items():
+            name = catalog.test_name(test, lang)
+            shown = catalog.get('value.present', lang) if value == "present" else value
+            status = classify_value(test, value)
+            description = catalog.get(f"kb.{test}.description", lang)
+            if status and description:
+                test_explanations[test] = catalog.get(
+                    'explanation.value_status', lang, test=name, value=shown,
+                    status=catalog.get(f"status.{status}", lang), description=description)
+            else:
+                test_explanations[test] = catalog.get('explanation.value', lang, test=name, value=shown)
+            if status in ('low', 'high'):
+                out_of_range = True
+                kb_tip = catalog.get(f"kb.{test}.lifestyle_tips", lang)
+                if kb_tip and kb_tip not in tips:
+                    tips.append(kb_tip)
+        
         return {
             "summary": summary,
-            "test_explanations": {test: f"Your report shows {test.replace('_', ' ')}: {value}" for test, value in lab_values.items()},
+            "test_explanations": test_explanations,
             "lifestyle_tips": tips,
-            "when_to_see_doctor": "Please consult your healthcare provider for medical advice about these findings.",
+            "when_to_see_doctor": catalog.get('doctor.abnormal' if out_of_range else 'doctor.general', lang),
             "risk_level": risk_level
         }
 
@@ -172,61 +307,122 @@ processor = MedicalReportProcessor()
 
 @app.route('/api/upload', methods=['POST'])
 def upload_report():
+    start = time.perf_counter()
+    with profiler.profile('upload'):
+        response, status = _process_upload()
+    REQUEST_LATENCY.observe(time.perf_counter() - start, status=status)
+    return response, status
+
+def _process_upload():
     try:
-        if 'file' not in request.files:
+        # Parsing the multipart body buffers the upload (see UploadRequest)
+        with STAGE_LATENCY.time(stage='upload_receive'):
+            files = request.files
+        if 'file' not in files:
             return jsonify({'error': 'No file uploaded'}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-            file.save(tmp_file.name)
+        lang = get_catalog().resolve_language(request.args.get('lang') or request.form.get('lang'))
+        
+        # Route to a priority lane by size (and page count for PDFs)
+        is_pdf = file.filename.lower().endswith('.pdf')
+        file.stream.seek(0, os.SEEK_END)
+        size = file.stream.tell()
+        file.stream.seek(0)
+        pdf_path = staged_path(file.stream) if is_pdf else None
+        pages = count_pdf_pages(pdf_path) if pdf_path else None
+        lane = admission.choose_lane(file.filename, size, pages)
+        
+        with admission.admit(lane):
+            # Look for an earlier photo or scan of the same report; the quick pass only reads one page
+            upload_hash, previous, near_duplicate = None, None, None
+            if duplicates.enabled and db and (not is_pdf or pages == 1):
+                upload_hash, previous, near_duplicate = processor.find_near_duplicate(file.stream, is_pdf)
             
-            # Extract text based on file type
-            if file.filename.lower().endswith('.pdf'):
-                extracted_text = processor.extract_text_from_pdf(tmp_file.name)
+            if previous:
+                # Near-duplicate: reuse the stored OCR text and explanation
+                EVENTS.inc(event='cache_hit')
+                extracted_text = previous['extracted_text']
+                lab_values = previous['lab_values']
+                if lang == get_catalog().default_language:
+                    explanation = previous['explanation']
+                else:
+                    explanation = processor.generate_explanation_with_rag(lab_values, extracted_text, lang)
+                upload_hash = None
             else:
-                extracted_text = processor.extract_text_from_image(tmp_file.name)
-            
-            # Debug: Print extracted text
-            print(f"Extracted text length: {len(extracted_text)}")
-            print(f"First 200 chars: {extracted_text[:200]}")
+                if upload_hash is not None:
+                    EVENTS.inc(event='cache_miss')
+                
+                # Extract text based on file type, straight from the upload buffer
+                if is_pdf:
+                    extracted_text = processor.extract_text_from_pdf(file.stream)
+                else:
+                    extracted_text = processor.extract_text_from_image(file.stream)
+                
+                # If OCR fails, use fallback text for testing
+                if not extracted_text or len(extracted_text.strip()) < 10:
+                    extracted_text = "No text extracted from file"
+                
+                # Parse lab values
+                lab_values = processor.parse_lab_values(extracted_text)
+                
+                # Generate explanation using RAG
+                explanation = processor.generate_explanation_with_rag(lab_values, extracted_text, lang)
+                
+                # Only reports with parsed values and an English explanation are indexed for reuse
+                if not lab_values or lang != get_catalog().default_language:
+                    upload_hash = None
             
-            # Clean up temporary file
-            os.unlink(tmp_file.name)
-        
-        # If OCR fails, use fallback text for testing
-        if not extracted_text or len(extracted_text.strip()) < 10:
-            extracted_text = "No text extracted from file"
-        
-        # Parse lab values
-        lab_values = processor.parse_lab_values(extracted_text)
-        
-        # Generate explanation using RAG
-        explanation = processor.generate_explanation_with_rag(lab_values, extracted_text)
-        
-        # Save to database
-        if db:
-            report_id = db.save_report(file.filename, extracted_text, lab_values, explanation)
-        else:
-            report_id = None
+            # Save to database
+            if db:
+                report_id = db.save_report(file.filename, extracted_text, lab_values, explanation,
+                                           format_hash(upload_hash) if upload_hash is not None else None)
+                if upload_hash is not None:
+                    duplicates.add(upload_hash, report_id)
+            else:
+                report_id = None
         
         return jsonify({
             'success': True,
             'report_id': report_id,
             'extracted_text': extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text,
             'lab_values': lab_values,
-            'explanation': explanation
-        })
+            'explanation': explanation,
+            'language': lang,
+            'near_duplicate': near_duplicate
+        }), 200
         
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'File too large. Maximum upload size is {MAX_UPLOAD_BYTES / (1024 * 1024):.1f} MB'}), 413
     except Exception as e:
+        EVENTS.inc(event='upload_error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'})
+    status = {'status': 'healthy'}
+    if hasattr(db, 'sync_status'):
+        status['sync'] = db.sync_status()
+    return jsonify(status)
+
+@app.route('/api/languages', methods=['GET'])
+def get_languages():
+    """Languages available for explanations"""
+    catalog = get_catalog()
+    return jsonify({'success': True, 'version': catalog.version,
+                    'default': catalog.default_language, 'languages': catalog.languages})
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/reports/<int:report_id>', methods=['GET'])
 def get_report(report_id):
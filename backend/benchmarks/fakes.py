@@ -0,0 +1,281 @@
+"""Local stand-ins for the external services used by the backend.
+
+They let the benchmarks exercise the real code paths without network
+access: an OpenAI-compatible HTTP server, a deterministic embedding
+function for Chroma, an SQLite store with the MySQLDatabase interface and
+a central MySQL stand-in for the offline sync agent.
+"""
+import re
+import json
+import time
+import zlib
+import math
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_EXPLANATION = {
+    "summary": "Most of your results are close to the normal range.",
+    "test_explanations": {},
+    "lifestyle_tips": ["Eat more green vegetables", "Walk for 30 minutes every day"],
+    "when_to_see_doctor": "Visit the health centre if you feel weak or dizzy.",
+    "risk_level": "Low",
+}
+
+
+class FakeOpenAIServer:
+    """Minimal OpenAI-compatible server that answers chat completions with a canned explanation"""
+
+    def __init__(self, latency=0.0, explanation=None):
+        self.latency = latency
+        self.explanation = explanation or FAKE_EXPLANATION
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                with fake._lock:
+                    fake.requests.append(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                prompt = "".join(m.get('content', '') for m in body.get('messages', []))
+                payload = json.dumps({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get('model', 'gpt-3.5-turbo'),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": json.dumps(fake.explanation)},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 60,
+                              "total_tokens": len(prompt) // 4 + 60},
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HashingEmbeddingFunction:
+    """Deterministic bag-of-words embeddings so Chroma runs without downloading a model"""
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def __call__(self, texts):
+        embeddings = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for token in text.lower().replace('_', ' ').split():
+                token = token.strip('.,:;()')
+                if token:
+                    vector[zlib.crc32(token.encode()) % self.dimensions] += 1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
+
+
+class SQLiteReportStore:
+    """In-memory SQLite stand-in with the same interface as MySQLDatabase"""
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT,
+                extracted_text TEXT,
+                lab_values TEXT,
+                explanation TEXT,
+                image_hash TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS lab_values (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                report_id INTEGER REFERENCES reports(id),
+                test_name TEXT,
+                test_value REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+    def save_report(self, filename, extracted_text, lab_values, explanation, image_hash=None):
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO reports (filename, extracted_text, lab_values, explanation, image_hash) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (filename, extracted_text, json.dumps(lab_values), json.dumps(explanation), image_hash),
+            )
+            report_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO lab_values (report_id, test_name, test_value) VALUES (?, ?, ?)",
+                [(report_id, name, value) for name, value in lab_values.items() if isinstance(value, (int, float))],
+            )
+            return report_id
+
+    def get_report(self, report_id):
+        with self._lock:
+            row = self.connection.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        if not row:
+            return None
+        report = dict(row)
+        report['lab_values'] = json.loads(report['lab_values'])
+        report['explanation'] = json.loads(report['explanation'])
+        return report
+
+    def get_recent_reports(self, limit=10):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, filename, created_at FROM reports ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_image_hashes(self, after_id=0):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, image_hash FROM reports WHERE image_hash IS NOT NULL AND id > ? ORDER BY id",
+                (after_id,),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+class FakeCentralMySQL:
+    """SQLite-backed stand-in for the central MySQL server that the sync agent pushes to.
+
+    connect() fails while online is False, and fail_after makes the
+    connection drop once that many statements have run in total, to
+    exercise retries. legacy_schema creates reports without the columns
+    added after the first release, as setup_database.py did.
+    """
+
+    def __init__(self, legacy_schema=False):
+        self.online = True
+        self.fail_after = None
+        self.statements = 0
+        self.connections = 0
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        added_columns = "" if legacy_schema else "image_hash TEXT, client_uuid TEXT UNIQUE,"
+        self._db.executescript(f"""
+            CREATE TABLE reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT,
+                extracted_text TEXT,
+                lab_values TEXT,
+                explanation TEXT,
+                {added_columns}
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE lab_values (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                report_id INTEGER,
+                test_name TEXT,
+                test_value REAL
+            );
+        """)
+        self._db.commit()
+
+    def connect(self):
+        if not self.online:
+            raise ConnectionError("central database unreachable")
+        self.connections += 1
+        return _FakeCentralConnection(self)
+
+    def count(self, table):
+        return self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def columns(self, table):
+        return [row[1] for row in self._db.execute(f"PRAGMA table_info({table})")]
+
+    def _add_column(self, table, column, definition):
+        # MySQL semantics: error 1060 for an existing column; SQLite cannot add a UNIQUE column directly
+        if column in self.columns(table):
+            from mysql.connector.errors import ProgrammingError
+            raise ProgrammingError(msg=f"Duplicate column name '{column}'", errno=1060)
+        self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition.replace('UNIQUE', '')}")
+        if 'UNIQUE' in definition:
+            self._db.execute(f"CREATE UNIQUE INDEX idx_{table}_{column} ON {table} ({column})")
+        return self._db.execute("SELECT 1")
+
+    def _execute(self, method, sql, params):
+        if self.fail_after is not None and self.statements >= self.fail_after:
+            raise ConnectionError("connection to central database lost")
+        self.statements += 1
+        alter = re.match(r'ALTER TABLE (\w+) ADD COLUMN (\w+) (.*)', sql)
+        if alter:
+            return self._add_column(*alter.groups())
+        if re.match(r'ALTER TABLE \w+ MODIFY COLUMN', sql):
+            # SQLite columns have no length to change
+            return self._db.execute("SELECT 1")
+        sql = sql.replace('%s', '?').replace('ON DUPLICATE KEY UPDATE client_uuid = client_uuid',
+                                             'ON CONFLICT(client_uuid) DO NOTHING')
+        return getattr(self._db, method)(sql, params)
+
+
+class _FakeCentralConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self):
+        return _FakeCentralCursor(self.server)
+
+    def commit(self):
+        self.server._db.commit()
+
+    def rollback(self):
+        self.server._db.rollback()
+
+    def close(self):
+        self.server._db.rollback()
+
+
+class _FakeCentralCursor:
+    def __init__(self, server):
+        self.server = server
+        self._result = None
+
+    def execute(self, sql, params=()):
+        self._result = self.server._execute('execute', sql, params)
+
+    def executemany(self, sql, rows):
+        self._result = self.server._execute('executemany', sql, rows)
+
+    def fetchall(self):
+        return self._result.fetchall()
+
+    def close(self):
+        pass
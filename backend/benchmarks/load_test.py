@@ -0,0 +1,184 @@
+"""Mixed-workload load test for upload admission control.
+
+Small phone-photo uploads and large multi-page PDFs are posted concurrently
+to a threaded server, once with admission control enabled and once with it
+disabled, and the p95 latency of each class is compared:
+
+    python -m benchmarks.load_test --duration 30 --small-clients 6 --large-clients 6
+
+Without tesseract/pdftoppm (or with --simulate-ocr) OCR is replaced by a
+subprocess that burns a fixed amount of CPU per page, which reproduces the
+CPU contention of real Tesseract runs.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import subprocess
+import http.client
+
+from benchmarks.fakes import FakeOpenAIServer, HashingEmbeddingFunction, SQLiteReportStore
+from benchmarks.run_benchmarks import percentile, tool_available
+from benchmarks.synthetic_reports import generate_report
+
+
+def calibrate_spin(target_ms):
+    """Loop iterations that take roughly target_ms of CPU in a fresh interpreter"""
+    probe = 2_000_000
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'n={probe}\nwhile n: n -= 1'], check=True)
+    startup = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    overhead = time.perf_counter() - startup
+    per_iteration = max(1e-9, (startup - start - overhead) / probe)
+    return max(1, int((target_ms / 1000.0 - overhead) / per_iteration))
+
+
+def install_ocr_stand_in(app_module, page_ms):
+    """Swap Tesseract and poppler for CPU-bound subprocesses of a fixed size"""
+    import re
+    from PIL import Image
+
+    def count_pages(source):
+        if not isinstance(source, (bytes, bytearray)):
+            with open(source, 'rb') as f:
+                source = f.read()
+        return max(1, len(re.findall(rb'/Type\s*/Page(?![a-zA-Z])', source)))
+
+    iterations = calibrate_spin(page_ms)
+
+    def image_to_string(image, config=''):
+        subprocess.run([sys.executable, '-c', f'n={iterations}\nwhile n: n -= 1'], check=True)
+        return "Hemoglobin 12.5 g/dL\nGlucose 95 mg/dL\n"
+
+    def convert(source, dpi=200, first_page=None, last_page=None, **kwargs):
+        pages = count_pages(source)
+        first = first_page or 1
+        last = min(last_page or pages, pages)
+        return [Image.new('RGB', (8, 8), 'white') for _ in range(max(1, last - first + 1))]
+
+    def pdfinfo(source, **kwargs):
+        return {'Pages': count_pages(source)}
+
+    app_module.pytesseract.image_to_string = image_to_string
+    app_module.pdf2image.convert_from_bytes = convert
+    app_module.pdf2image.convert_from_path = convert
+    app_module.pdf2image.pdfinfo_from_bytes = pdfinfo
+    app_module.pdf2image.pdfinfo_from_path = pdfinfo
+
+
+def multipart_body(filename, data, boundary='loadtestboundary'):
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head + data + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def client_loop(port, report, deadline, results, kind):
+    body, content_type = multipart_body(report.filename, report.data)
+    while time.time() < deadline:
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        try:
+            conn.request('POST', '/api/upload', body=body, headers={'Content-Type': content_type})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            retry_after = response.getheader('Retry-After')
+        finally:
+            conn.close()
+        elapsed = time.perf_counter() - start
+        results.append((kind, status, elapsed))
+        if status == 429:
+            # Honour Retry-After, capped so the test keeps the server under pressure
+            time.sleep(min(float(retry_after or 1), 2.0) * random.uniform(0.5, 1.0))
+
+
+def run_workload(app_module, admission, args, small_report, large_report):
+    from werkzeug.serving import make_server
+
+    app_module.admission = admission
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    results = []
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=client_loop, args=(port, small_report, deadline, results, 'small'))
+               for _ in range(args.small_clients)]
+    threads += [threading.Thread(target=client_loop, args=(port, large_report, deadline, results, 'large'))
+                for _ in range(args.large_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    summary = {}
+    for kind in ('small', 'large'):
+        ok = [elapsed for k, status, elapsed in results if k == kind and status == 200]
+        summary[kind] = {
+            "completed": len(ok),
+            "rejected_429": sum(1 for k, status, _ in results if k == kind and status == 429),
+            "errors": sum(1 for k, status, _ in results if k == kind and status not in (200, 429)),
+            "p50_ms": round(percentile(ok, 50) * 1000, 1),
+            "p95_ms": round(percentile(ok, 95) * 1000, 1),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per scenario')
+    parser.add_argument('--small-clients', type=int, default=6)
+    parser.add_argument('--large-clients', type=int, default=6)
+    parser.add_argument('--large-pages', type=int, default=8)
+    parser.add_argument('--llm-latency-ms', type=float, default=300)
+    parser.add_argument('--simulate-ocr', action='store_true', help='use the CPU-bound OCR stand-in')
+    parser.add_argument('--ocr-page-ms', type=float, default=400, help='CPU time per page for the stand-in')
+    parser.add_argument('--output', help='write the summary as JSON')
+    args = parser.parse_args(argv)
+
+    fake_llm = FakeOpenAIServer(latency=args.llm_latency_ms / 1000.0).start()
+    os.environ['OPENAI_API_KEY'] = 'load-test'
+    os.environ['OPENAI_BASE_URL'] = fake_llm.base_url
+    os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+
+    import app as app_module
+    from admission import AdmissionController
+    from rag_system import MedicalRAGSystem
+
+    app_module.rag_system = MedicalRAGSystem(embedding_function=HashingEmbeddingFunction())
+    app_module.db = SQLiteReportStore()
+    if args.simulate_ocr or not (tool_available('tesseract') and tool_available('pdftoppm')):
+        print(f"Using CPU-bound OCR stand-in ({args.ocr_page_ms:.0f} ms per page)")
+        install_ocr_stand_in(app_module, args.ocr_page_ms)
+
+    small_report = generate_report(seed=1, noise=0.3, fmt='jpg')
+    large_report = generate_report(seed=2, pages=args.large_pages, fmt='pdf')
+
+    summary = {}
+    try:
+        for name, enabled in (("admission_on", True), ("admission_off", False)):
+            print(f"\nScenario {name}: {args.small_clients} small + {args.large_clients} large clients "
+                  f"for {args.duration:.0f}s")
+            summary[name] = run_workload(app_module, AdmissionController(enabled=enabled), args,
+                                         small_report, large_report)
+            for kind, stats in summary[name].items():
+                print(f"  {kind:<6} ok {stats['completed']:>4}  429 {stats['rejected_429']:>4}  "
+                      f"err {stats['errors']:>3}  p50 {stats['p50_ms']:>9.1f} ms  p95 {stats['p95_ms']:>9.1f} ms")
+    finally:
+        fake_llm.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
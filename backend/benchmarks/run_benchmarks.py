@@ -0,0 +1,436 @@
+"""Offline benchmark suite for the report pipeline.
+
+Run from the backend directory:
+
+    python -m benchmarks.run_benchmarks --output benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json
+
+The OpenAI API is replaced by a local fake server, Chroma runs in-process
+with a hashing embedding function and MySQL is replaced by SQLite, so the
+numbers measure this code rather than the network. OCR stages need the
+tesseract and pdftoppm binaries and are skipped when they are missing.
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from benchmarks.fakes import FakeOpenAIServer, HashingEmbeddingFunction, SQLiteReportStore, FakeCentralMySQL
+from benchmarks.synthetic_reports import (generate_corpus, generate_report, generate_same_template_corpus,
+                                         rephotograph, value_recall)
+from PIL import Image
+
+
+# Explanation prompt used before prompt_builder, kept to report the token savings
+LEGACY_PROMPT = """
+            You are a medical assistant helping rural patients understand their lab reports.
+            
+            MEDICAL CONTEXT FROM KNOWLEDGE BASE:
+            {context}
+            
+            PATIENT'S LAB VALUES: {values}
+            REPORT TEXT: {text}
+            
+            Provide a simple explanation using the medical context above:
+            1. Explain each test in simple terms
+            2. Compare values to normal ranges
+            3. Provide lifestyle suggestions (NO diagnosis/medication)
+            4. Use simple language for rural patients
+            5. Assess overall risk level as "Low", "Medium", or "High" based on the values.
+            
+            Return JSON: {{"summary": "", "test_explanations": {{}}, "lifestyle_tips": [], "when_to_see_doctor": "", "risk_level": "Low/Medium/High"}}
+            """
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(name, func, inputs, iterations):
+    """Time func over inputs, then run a separate pass under tracemalloc for peak memory"""
+    func(inputs[0])  # warm up connections and caches before timing
+    latencies = []
+    extras = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        result = func(inputs[i % len(inputs)])
+        latencies.append(time.perf_counter() - t0)
+        if isinstance(result, dict):
+            extras.append(result)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    peak = 0
+    for item in inputs[:iterations]:
+        tracemalloc.reset_peak()
+        func(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    stats = {
+        "iterations": iterations,
+        "throughput_per_s": round(iterations / elapsed, 3) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+    for key in sorted({k for extra in extras for k in extra}):
+        values = [extra[key] for extra in extras if isinstance(extra.get(key), (int, float))]
+        if values:
+            stats[key] = round(sum(values) / len(values), 4)
+    print(f"  {name:<24} p50 {stats['p50_ms']:>10.2f} ms   p95 {stats['p95_ms']:>10.2f} ms   "
+          f"{stats['throughput_per_s'] or 0:>8.2f}/s   peak {stats['peak_memory_kb']:>10.1f} KB")
+    return stats
+
+
+def process_io_bytes():
+    """Bytes this process has passed through read/write syscalls (Linux only)"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']) + int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def tool_available(name):
+    if name == 'tesseract':
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception:
+            return False
+    return shutil.which(name) is not None
+
+
+class BenchmarkContext:
+    """Wires the Flask app to the local stand-ins and holds the synthetic corpus"""
+
+    def __init__(self, corpus_size, seed, llm_latency):
+        self.fake_llm = FakeOpenAIServer(latency=llm_latency).start()
+        os.environ['OPENAI_API_KEY'] = 'benchmark'
+        os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+        os.environ['OPENAI_BASE_URL'] = self.fake_llm.base_url
+
+        import app as app_module
+        from rag_system import MedicalRAGSystem
+
+        app_module.rag_system = MedicalRAGSystem(embedding_function=HashingEmbeddingFunction())
+        app_module.db = SQLiteReportStore()
+        # The upload stages repeat the same reports; keep them from being served as near-duplicates
+        app_module.duplicates.max_distance = -1
+        self.app_module = app_module
+        self.processor = app_module.processor
+        self.client = app_module.app.test_client()
+
+        self.workdir = tempfile.mkdtemp(prefix='report-bench-')
+        self.corpus = generate_corpus(corpus_size, seed=seed)
+        # Phone-photo sized scans and scanned PDFs (roughly 1-5 MB) for the upload I/O stages
+        self.scans = [generate_report(seed=seed * 1000 + 500 + i, noise=0.5, dpi=dpi, fmt='png')
+                      for i, dpi in enumerate((110, 150, 200))]
+        self.scan_pdfs = [generate_report(seed=seed * 1000 + 600 + i, noise=0.5, dpi=dpi, fmt='pdf')
+                          for i, dpi in enumerate((300, 400, 600))]
+        self.paths = {}
+        for report in self.corpus:
+            path = os.path.join(self.workdir, report.filename)
+            with open(path, 'wb') as f:
+                f.write(report.data)
+            self.paths[report.filename] = path
+
+        self.ocr_available = tool_available('tesseract')
+        self.pdf_available = tool_available('pdftoppm')
+
+        # Reports for different patients on one lab template, stored the way /api/upload stores them.
+        # Near-duplicate queries are re-photographs of them and new reports on the same template.
+        from near_duplicate import NearDuplicateIndex, image_hash, format_hash
+        self.duplicate_db = SQLiteReportStore()
+        self.duplicates = NearDuplicateIndex(self.duplicate_db, refresh_seconds=0)
+        self.duplicate_of = {}
+        self.duplicate_photos = []
+        for report in generate_same_template_corpus(24, seed=seed):
+            text = self.processor.extract_text_from_image(report.data) if self.ocr_available else report.text
+            upload_hash = image_hash(self.processor._preview_image(report.data))
+            report_id = self.duplicate_db.save_report(report.filename, text, self.processor.parse_lab_values(text),
+                                                      {}, format_hash(upload_hash))
+            photo = rephotograph(report, seed=1)
+            self.duplicate_of[photo.filename] = report_id
+            self.duplicate_photos.append(photo)
+        self.new_photos = [rephotograph(report, seed=1) for report in generate_same_template_corpus(24, seed=seed + 1)]
+
+        # Offline-first store on disk; the sync agent is driven by hand in the offline_sync stage
+        from offline_store import OfflineFirstDatabase, SyncAgent
+        self.central = FakeCentralMySQL()
+        self.offline_db = OfflineFirstDatabase(os.path.join(self.workdir, 'offline.db'),
+                                               connect=self.central.connect, sync=False)
+        self.sync_agent = SyncAgent(self.offline_db, self.central.connect)
+
+    def reports(self, kind):
+        if kind == 'pdf':
+            return [r for r in self.corpus if r.filename.endswith('.pdf')]
+        if kind == 'image':
+            return [r for r in self.corpus if not r.filename.endswith('.pdf')]
+        return list(self.corpus)
+
+    def upload(self, report):
+        response = self.client.post('/api/upload', data={'file': (io.BytesIO(report.data), report.filename)},
+                                    content_type='multipart/form-data')
+        body = response.get_json() or {}
+        return {"recall": value_recall(report.expected, body.get('lab_values', {}))}
+
+    def close(self):
+        self.fake_llm.stop()
+        self.offline_db.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def build_stages(ctx):
+    """name -> (callable taking a SyntheticReport, inputs, reason the stage is skipped or None)"""
+    processor = ctx.processor
+    no_ocr = None if ctx.ocr_available else "tesseract not installed"
+    no_pdf = no_ocr or (None if ctx.pdf_available else "pdftoppm not installed")
+
+    def ocr_image(report):
+        text = processor.extract_text_from_image(ctx.paths[report.filename])
+        return {"recall": value_recall(report.expected, processor.parse_lab_values(text))}
+
+    def ocr_pdf(report):
+        text = processor.extract_text_from_pdf(ctx.paths[report.filename])
+        return {"recall": value_recall(report.expected, processor.parse_lab_values(text))}
+
+    def _with_io(func, report):
+        before = process_io_bytes()
+        func(report)
+        after = process_io_bytes()
+        return {"io_kb": (after - before) / 1024} if before is not None and after is not None else {}
+
+    def decode_tempfile(report):
+        # The previous upload path: write the upload to a named temp file, then reopen it by path
+        def run(r):
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
+                tmp_file.write(r.data)
+            try:
+                Image.open(tmp_file.name).convert('RGB')
+            finally:
+                os.unlink(tmp_file.name)
+        return _with_io(run, report)
+
+    def decode_memory(report):
+        return _with_io(lambda r: processor._open_image(r.data).convert('RGB'), report)
+
+    def receive(report, staged):
+        # /api/upload up to the OCR hand-off: multipart parsing, buffering and decoding or rendering
+        from flask import Request, request
+        app = ctx.app_module.app
+        is_pdf = report.filename.endswith('.pdf')
+        original = app.request_class
+        app.request_class = ctx.app_module.UploadRequest if staged else Request
+        try:
+            with app.test_request_context('/api/upload', method='POST', content_type='multipart/form-data',
+                                          data={'file': (io.BytesIO(report.data), report.filename)}):
+                file = request.files['file']
+                if staged:
+                    if is_pdf:
+                        processor._render_pdf(file.stream)
+                    else:
+                        processor._open_image(file.stream).convert('RGB')
+                    return
+                # The previous upload path: save to a named temp file, then reopen it by path
+                suffix = os.path.splitext(report.filename)[1]
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                    file.save(tmp_file.name)
+                try:
+                    if is_pdf:
+                        processor._render_pdf(tmp_file.name)
+                    else:
+                        Image.open(tmp_file.name).convert('RGB')
+                finally:
+                    os.unlink(tmp_file.name)
+        finally:
+            app.request_class = original
+
+    def prompt_build(report):
+        from prompt_builder import build_prompt, count_tokens
+        rag_context = ctx.app_module.rag_system.generate_rag_context(report.expected, report.text)
+        prompt, stats = build_prompt(report.expected, report.text, rag_context)
+        # The previous fixed prompt: every retrieved entry in full plus the first 800 report characters
+        context_str = "\n".join(f"- {item['test']}: {item['description']}. Normal: {item['normal_range']}. "
+                                f"Tips: {item['lifestyle_tips']}" for item in rag_context)
+        legacy = LEGACY_PROMPT.format(context=context_str, values=json.dumps(report.expected),
+                                      text=report.text[:800])
+        legacy = count_tokens(legacy)
+        return {
+            "prompt_tokens": stats['prompt_tokens'],
+            "legacy_prompt_tokens": legacy,
+            "abnormal_coverage": stats['abnormal_included'] / stats['abnormal_total'] if stats['abnormal_total'] else 1.0,
+            "dropped_items": stats['dropped'],
+        }
+
+    def near_duplicate(report):
+        # Layout hash and index lookup only: is the original found, and would the confirming OCR pass run
+        from near_duplicate import image_hash
+        candidates = ctx.duplicates.lookup(image_hash(processor._preview_image(report.data)))
+        ids = [report_id for report_id, _ in candidates]
+        original = ctx.duplicate_of.get(report.filename)
+        confirmable = ctx.duplicates.confirmable(candidates)
+        return {
+            "original_found": 1.0 if original in ids else 0.0,
+            "original_closest": 1.0 if original is not None and ids[:1] == [original] else 0.0,
+            # Upper bound on the reuse rate: the confirming pass runs and the original is among its candidates
+            "original_checked": 1.0 if confirmable and original in ids else 0.0,
+            "candidates": len(ids),
+            "ocr_pass": 1.0 if confirmable else 0.0,
+        }
+
+    def find_near_duplicate(report):
+        # The whole check as /api/upload runs it, so the latency is what every image upload pays
+        app_module = ctx.app_module
+        saved = app_module.duplicates, app_module.db
+        app_module.duplicates, app_module.db = ctx.duplicates, ctx.duplicate_db
+        try:
+            _, previous, match = processor.find_near_duplicate(io.BytesIO(report.data))
+        finally:
+            app_module.duplicates, app_module.db = saved
+        original = ctx.duplicate_of.get(report.filename)
+        reused = match['report_id'] if match else None
+        return {
+            "hit": 1.0 if original is not None and reused == original else 0.0,
+            "false_reuse": 1.0 if reused is not None and reused != original else 0.0,
+        }
+
+    def offline_sync(report):
+        # Ten uploads while the uplink is down, then one sync once it is back
+        ctx.central.online = False
+        for i in range(10):
+            ctx.offline_db.save_report(f"{i}-{report.filename}", report.text, report.expected, {})
+        queued = ctx.offline_db.sync_status()['queue_size']
+        ctx.central.online = True
+        ctx.sync_agent.sync_once()
+        return {"queued": queued, "remaining": ctx.offline_db.sync_status()['queue_size'],
+                "central_reports": ctx.central.count('reports')}
+
+    def parse(report):
+        return {"recall": value_recall(report.expected, processor.parse_lab_values(report.text))}
+
+    return {
+        "ocr_image": (ocr_image, ctx.reports('image'), no_ocr),
+        "ocr_pdf": (ocr_pdf, ctx.reports('pdf'), no_pdf),
+        "upload_io_tempfile": (decode_tempfile, ctx.scans, None),
+        "upload_io_memory": (decode_memory, ctx.scans, None),
+        "upload_request_tempfile": (lambda r: _with_io(lambda r: receive(r, False), r), ctx.scans, None),
+        "upload_request": (lambda r: _with_io(lambda r: receive(r, True), r), ctx.scans, None),
+        "upload_request_pdf_tempfile": (lambda r: _with_io(lambda r: receive(r, False), r), ctx.scan_pdfs,
+                                        None if ctx.pdf_available else "pdftoppm not installed"),
+        "upload_request_pdf": (lambda r: _with_io(lambda r: receive(r, True), r), ctx.scan_pdfs,
+                               None if ctx.pdf_available else "pdftoppm not installed"),
+        # Same-template corpus: re-photographs of stored reports, then new reports for the same patients
+        # that must not be reused
+        "near_duplicate": (near_duplicate, ctx.duplicate_photos, None),
+        "near_duplicate_new": (near_duplicate, ctx.new_photos, None),
+        "near_duplicate_e2e": (find_near_duplicate, ctx.duplicate_photos, no_ocr),
+        "near_duplicate_e2e_new": (find_near_duplicate, ctx.new_photos, no_ocr),
+        "parse": (parse, ctx.reports('all'), None),
+        "rag": (lambda r: ctx.app_module.rag_system.generate_rag_context(r.expected, r.text),
+                ctx.reports('all'), None),
+        "prompt_build": (prompt_build, ctx.reports('all'), None),
+        "explanation": (lambda r: processor.generate_explanation_with_rag(r.expected, r.text),
+                        ctx.reports('all'), None),
+        "db_save": (lambda r: ctx.app_module.db.save_report(r.filename, r.text, r.expected, {}),
+                    ctx.reports('all'), None),
+        "db_save_offline": (lambda r: ctx.offline_db.save_report(r.filename, r.text, r.expected, {}),
+                            ctx.reports('all'), None),
+        "offline_sync": (offline_sync, ctx.reports('all'), None),
+        "upload_image": (ctx.upload, ctx.reports('image'), no_ocr),
+        "upload_pdf": (ctx.upload, ctx.reports('pdf'), no_pdf),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Print per-stage deltas and return the stages whose p95 regressed beyond tolerance"""
+    regressions = []
+    print(f"\n{'stage':<24} {'baseline p95':>14} {'current p95':>14} {'change':>9}")
+    for name, stats in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "p95_ms" not in base or "p95_ms" not in stats:
+            continue
+        change = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:<24} {base['p95_ms']:>11.2f} ms {stats['p95_ms']:>11.2f} ms {change:>+8.1%}{flag}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20, help='timed calls per stage')
+    parser.add_argument('--corpus-size', type=int, default=12, help='number of synthetic reports')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='artificial delay of the fake OpenAI server')
+    parser.add_argument('--stages', help='comma-separated subset of stages to run')
+    parser.add_argument('--output', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown before failing (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    ctx = BenchmarkContext(args.corpus_size, args.seed, args.llm_latency_ms / 1000.0)
+    try:
+        stages = build_stages(ctx)
+        selected = args.stages.split(',') if args.stages else list(stages)
+        results = {
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "ocr_available": ctx.ocr_available,
+                "pdf_available": ctx.pdf_available,
+                "corpus_size": args.corpus_size,
+                "seed": args.seed,
+                "llm_latency_ms": args.llm_latency_ms,
+            },
+            "stages": {},
+        }
+        print("Running benchmarks...")
+        for name in selected:
+            if name not in stages:
+                parser.error(f"unknown stage {name}; choose from {', '.join(stages)}")
+            func, inputs, skip_reason = stages[name]
+            if skip_reason or not inputs:
+                reason = skip_reason or "no matching reports in corpus"
+                print(f"  {name:<24} skipped ({reason})")
+                results["stages"][name] = {"skipped": reason}
+                continue
+            results["stages"][name] = measure(name, func, inputs, args.iterations)
+    finally:
+        ctx.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\np95 regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Synthetic lab reports for benchmarking the OCR and parsing pipeline.
+
+Reports are rendered with PIL so every run works offline and the ground
+truth (which analytes appear and their values) is known exactly.
+"""
+import io
+import random
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# key -> (label printed on the report, unit, reference range, (min, max) for random values)
+ANALYTES = {
+    'hemoglobin': ('Hemoglobin', 'g/dL', '12.0 - 16.0', (8.0, 18.0)),
+    'glucose': ('Glucose Fasting', 'mg/dL', '70 - 100', (60.0, 250.0)),
+    'cholesterol': ('Total Cholesterol', 'mg/dL', '< 200', (120.0, 300.0)),
+    'creatinine': ('Creatinine', 'mg/dL', '0.6 - 1.2', (0.4, 3.0)),
+    'white_blood_cells': ('WBC Count', 'cells/mcL', '4000 - 11000', (2000.0, 20000.0)),
+    'platelets': ('Platelets', 'per mcL', '150000 - 450000', (50000.0, 600000.0)),
+    'blood_pressure': ('Blood Pressure', 'mmHg', '120/80', None),
+}
+
+FILLER_LINES = [
+    "Sample collected at the primary health centre.",
+    "Results should be interpreted together with clinical findings.",
+    "Report verified by the laboratory in-charge.",
+    "Kindly bring this report on your next visit.",
+]
+
+# Names of different lengths, as on reports from one lab for different patients
+PATIENT_NAMES = [
+    "Asha Devi", "Ramesh Kumar", "Lakshmi Narayanan", "Mohd. Imran", "Priya S", "Gurpreet Kaur Sandhu",
+    "Anil Joshi", "Fatima Begum", "K. Venkatesh", "Sunita Rani", "Biju Thomas", "Meenakshi Sundaram",
+    "Ravi", "Harpreet Singh", "Deepa Menon", "Suresh Babu Reddy", "Nirmala", "Joseph D'Souza",
+    "Kavita Sharma", "Abdul Rahman", "Pooja", "Manoj Tiwari", "Sarojini Pillai", "Vijay Patil",
+]
+
+PAGE_SIZE = (8.27, 11.69)  # A4 in inches
+
+
+class SyntheticReport:
+    """A rendered report together with the values printed on it"""
+
+    def __init__(self, filename, data, expected, text, pages):
+        self.filename = filename
+        self.data = data
+        self.expected = expected
+        self.text = text
+        self.pages = pages
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+def _load_font(size):
+    for name in ("DejaVuSansMono.ttf", "DejaVuSans.ttf",
+                 "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def _random_value(rng, key):
+    spec = ANALYTES[key]
+    if spec[3] is None:
+        return f"{rng.randint(100, 180)}/{rng.randint(60, 110)}"
+    low, high = spec[3]
+    if high >= 1000:
+        return float(rng.randint(int(low), int(high)))
+    return round(rng.uniform(low, high), 1)
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def render_page(lines, dpi=150, noise=0.0, rng=None):
+    """Render text lines onto a white A4 page, optionally degraded like a phone photo"""
+    rng = rng or random.Random(0)
+    width, height = int(PAGE_SIZE[0] * dpi), int(PAGE_SIZE[1] * dpi)
+    page = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    font = _load_font(max(12, dpi // 7))
+    line_height = int(dpi * 0.28)
+    margin = int(dpi * 0.6)
+    y = margin
+    for line in lines:
+        draw.text((margin, y), line, fill=0, font=font)
+        y += line_height
+
+    if noise > 0:
+        grain = Image.effect_noise((width, height), 40 + 120 * noise)
+        page = Image.blend(page, grain, min(0.5, 0.35 * noise))
+        page = page.rotate(rng.uniform(-3, 3) * noise, expand=False, fillcolor=255)
+        page = page.filter(ImageFilter.GaussianBlur(radius=1.5 * noise))
+    return page.convert('RGB')
+
+
+def generate_report(seed=0, analytes=None, pages=1, noise=0.0, fmt='png', dpi=150, patient=None):
+    """Build one synthetic report.
+
+    analytes: keys from ANALYTES to print (default: a random subset)
+    pages: number of pages; analytes are spread across them (PDF only for pages > 1)
+    noise: 0.0 (clean scan) to 1.0 (grainy, rotated, blurred photo)
+    patient: name printed in the header (default: "Test Patient <seed>")
+    """
+    rng = random.Random(seed)
+    if analytes is None:
+        keys = list(ANALYTES)
+        analytes = rng.sample(keys, rng.randint(3, len(keys)))
+    if pages > 1 and fmt != 'pdf':
+        raise ValueError("Multi-page reports must be rendered as PDF")
+
+    expected = {key: _random_value(rng, key) for key in analytes}
+
+    header = [
+        "DISTRICT HOSPITAL LABORATORY",
+        f"Patient: {patient or f'Test Patient {seed}'}",
+        "Age / Sex: 45 / F",
+        "",
+        "Test                   Result    Unit        Reference",
+    ]
+    rows = []
+    for key, value in expected.items():
+        label, unit, reference, _ = ANALYTES[key]
+        rows.append(f"{label:<22} {_format_value(value):<9} {unit:<11} {reference}")
+
+    per_page = max(1, -(-len(rows) // pages))
+    page_lines = []
+    for i in range(pages):
+        chunk = rows[i * per_page:(i + 1) * per_page]
+        lines = (header if i == 0 else [f"Page {i + 1}", ""]) + chunk + [""] + rng.sample(FILLER_LINES, 2)
+        page_lines.append(lines)
+
+    images = [render_page(lines, dpi=dpi, noise=noise, rng=rng) for lines in page_lines]
+    buffer = io.BytesIO()
+    if fmt == 'pdf':
+        images[0].save(buffer, 'PDF', save_all=True, append_images=images[1:], resolution=dpi)
+    elif fmt in ('jpg', 'jpeg'):
+        images[0].save(buffer, 'JPEG', quality=90)
+    else:
+        images[0].save(buffer, 'PNG')
+
+    text = "\n\n".join("\n".join(lines) for lines in page_lines)
+    filename = f"synthetic_{seed}.{fmt}"
+    return SyntheticReport(filename, buffer.getvalue(), expected, text, pages)
+
+
+def rephotograph(report, seed=0, max_angle=2.0, max_crop=0.03):
+    """Another photo of the same paper report: slightly rotated, cropped, rescaled and re-exposed"""
+    from PIL import ImageEnhance
+
+    if report.filename.endswith('.pdf'):
+        raise ValueError("Only image reports can be re-photographed")
+    rng = random.Random(seed)
+    image = Image.open(io.BytesIO(report.data)).convert('RGB')
+    width, height = image.size
+    image = image.rotate(rng.uniform(-max_angle, max_angle), fillcolor='white')
+    image = image.crop((int(width * rng.uniform(0, max_crop)), int(height * rng.uniform(0, max_crop)),
+                        width - int(width * rng.uniform(0, max_crop)), height - int(height * rng.uniform(0, max_crop))))
+    image = ImageEnhance.Brightness(image).enhance(rng.uniform(0.85, 1.15))
+    scale = rng.uniform(0.7, 1.0)
+    image = image.resize((int(image.width * scale), int(image.height * scale)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    filename = report.filename.rsplit('.', 1)[0] + f"_photo{seed}.jpg"
+    return SyntheticReport(filename, buffer.getvalue(), report.expected, report.text, report.pages)
+
+
+def generate_corpus(count=10, seed=0, formats=('png', 'jpg', 'pdf'), max_pages=3, max_noise=0.6, dpi=150):
+    """A reproducible mix of clean and noisy image and PDF reports"""
+    rng = random.Random(seed)
+    reports = []
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        pages = rng.randint(1, max_pages) if fmt == 'pdf' else 1
+        noise = round(rng.uniform(0, max_noise), 2)
+        reports.append(generate_report(seed=seed * 1000 + i, pages=pages, noise=noise, fmt=fmt, dpi=dpi))
+    return reports
+
+
+def generate_same_template_corpus(count=24, seed=0, max_noise=0.45, fmt='png'):
+    """Reports for different patients on one lab template: every analyte, only names and values differ"""
+    rng = random.Random(seed)
+    return [generate_report(seed=seed * 1000 + i, analytes=list(ANALYTES), noise=round(rng.uniform(0, max_noise), 2),
+                            fmt=fmt, patient=PATIENT_NAMES[i % len(PATIENT_NAMES)])
+            for i in range(count)]
+
+
+def value_recall(expected, parsed):
+    """Fraction of printed analytes that parse_lab_values recovered with the right value"""
+    if not expected:
+        return 1.0
+    hits = 0
+    for key, value in expected.items():
+        found = parsed.get(key)
+        if found is None:
+            continue
+        if isinstance(value, str):
+            hits += found == value
+        else:
+            hits += abs(float(found) - float(value)) < 1e-6
+    return hits / len(expected)
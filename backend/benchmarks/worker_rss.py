@@ -0,0 +1,130 @@
+"""Total memory of a gunicorn deployment with and without the shared RAG index.
+
+Starts gunicorn with 1, 4 and 8 workers, once with a Chroma collection per
+worker and once with the memory-mapped index built by the master, and sums
+RSS and PSS over the master and its workers once they are up:
+
+    python -m benchmarks.worker_rss --workers 1,4,8
+
+RSS counts shared pages once per process; PSS splits them between the
+processes sharing them, so its sum is the real footprint.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid):
+    """(rss_kb, pss_kb) of one process from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                fields[parts[0][:-1]] = parts[1]
+    return int(fields.get('Rss', 0)), int(fields.get('Pss', 0))
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def wait_ready(proc, port, workers, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/health')
+            conn.getresponse().read()
+            conn.close()
+            if len(children(proc.pid)) >= workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run(workers, shared, args, index_path):
+    port = free_port()
+    env = dict(os.environ,
+               OPENAI_API_KEY='rss-benchmark',
+               ANONYMIZED_TELEMETRY='False',
+               WEB_CONCURRENCY=str(workers),
+               GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_THREADS='2',
+               RAG_SHARED_INDEX='1' if shared else '0',
+               RAG_EMBEDDING_FUNCTION=args.embedding_function)
+    env.pop('RAG_INDEX_PATH', None)
+    if shared:
+        env['RAG_INDEX_PATH'] = index_path
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(proc, port, workers, args.timeout)
+        time.sleep(args.settle)
+        pids = [proc.pid] + children(proc.pid)
+        totals = [memory_kb(pid) for pid in pids]
+        return {
+            "processes": len(pids),
+            "rss_mb": round(sum(rss for rss, _ in totals) / 1024, 1),
+            "pss_mb": round(sum(pss for _, pss in totals) / 1024, 1),
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,4,8')
+    parser.add_argument('--embedding-function', default='',
+                        help='module:attribute of the embedding function (default: Chroma default model); '
+                             'benchmarks.fakes:HashingEmbeddingFunction runs offline')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds to wait after startup before sampling')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    index_path = tempfile.mkdtemp(prefix='rag-index-')
+    results = {}
+    try:
+        print(f"{'workers':>7} {'mode':<12} {'processes':>9} {'total RSS':>12} {'total PSS':>12}")
+        for count in [int(n) for n in args.workers.split(',')]:
+            for mode, shared in (("per_worker", False), ("shared", True)):
+                stats = run(count, shared, args, index_path)
+                results.setdefault(str(count), {})[mode] = stats
+                print(f"{count:>7} {mode:<12} {stats['processes']:>9} {stats['rss_mb']:>9.1f} MB "
+                      f"{stats['pss_mb']:>9.1f} MB")
+    finally:
+        shutil.rmtree(index_path, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
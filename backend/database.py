@@ -3,6 +3,41 @@ from mysql.connector import Error
 import json
 from datetime import datetime
 import os
+from metrics import timed, DB_LATENCY, EVENTS
+
+# Columns added to reports after the first release
+REPORT_COLUMNS = (
+    ('image_hash', 'VARCHAR(320) NULL'),
+    ('client_uuid', 'CHAR(36) NULL UNIQUE'),
+)
+# Columns whose type changed after they were added (image_hash was a 64-bit CHAR(16) hash)
+RESIZED_REPORT_COLUMNS = ('image_hash',)
+
+def add_report_columns(connection):
+    """Bring a reports table created by an earlier release up to REPORT_COLUMNS; True if it succeeded"""
+    ok = True
+    for name, definition in REPORT_COLUMNS:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"ALTER TABLE reports ADD COLUMN {name} {definition}")
+            connection.commit()
+        except Error as e:
+            if e.errno != 1060:  # ER_DUP_FIELDNAME: column already there
+                print(f"Error adding {name} column: {e}")
+                EVENTS.inc(event='db_error')
+                ok = False
+                continue
+            if name in RESIZED_REPORT_COLUMNS:
+                try:
+                    cursor.execute(f"ALTER TABLE reports MODIFY COLUMN {name} {definition}")
+                    connection.commit()
+                except Error as e:
+                    print(f"Error resizing {name} column: {e}")
+                    EVENTS.inc(event='db_error')
+                    ok = False
+        finally:
+            cursor.close()
+    return ok
 
 class MySQLDatabase:
     def __init__(self):
@@ -10,6 +45,7 @@ class MySQLDatabase:
         self.connect()
         self.create_tables()
     
+    @timed(DB_LATENCY, operation='connect')
     def connect(self):
         """Connect to MySQL database"""
         try:
@@ -21,6 +57,7 @@ class MySQLDatabase:
             )
         except Error as e:
             print(f"Error connecting to MySQL: {e}")
+            EVENTS.inc(event='db_error')
     
     def create_tables(self):
         """Create necessary tables"""
@@ -37,6 +74,8 @@ class MySQLDatabase:
             extracted_text TEXT,
             lab_values JSON,
             explanation JSON,
+            image_hash VARCHAR(320) NULL,
+            client_uuid CHAR(36) NULL UNIQUE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """
@@ -61,10 +100,14 @@ class MySQLDatabase:
             self.connection.commit()
         except Error as e:
             print(f"Error creating tables: {e}")
+            EVENTS.inc(event='db_error')
         finally:
             cursor.close()
+        
+        add_report_columns(self.connection)
     
-    def save_report(self, filename, extracted_text, lab_values, explanation):
+    @timed(DB_LATENCY, operation='save_report')
+    def save_report(self, filename, extracted_text, lab_values, explanation, image_hash=None):
         """Save report analysis to database"""
         if not self.connection:
             return None
@@ -74,14 +117,15 @@ class MySQLDatabase:
         try:
             # Insert report
             insert_report = """
-            INSERT INTO reports (filename, extracted_text, lab_values, explanation)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO reports (filename, extracted_text, lab_values, explanation, image_hash)
+            VALUES (%s, %s, %s, %s, %s)
             """
             cursor.execute(insert_report, (
                 filename,
                 extracted_text,
                 json.dumps(lab_values),
-                json.dumps(explanation)
+                json.dumps(explanation),
+                image_hash
             ))
             
             report_id = cursor.lastrowid
@@ -100,10 +144,12 @@ class MySQLDatabase:
             
         except Error as e:
             print(f"Error saving report: {e}")
+            EVENTS.inc(event='db_error')
             return None
         finally:
             cursor.close()
     
+    @timed(DB_LATENCY, operation='get_report')
     def get_report(self, report_id):
         """Get report by ID"""
         if not self.connection:
@@ -123,10 +169,12 @@ class MySQLDatabase:
             
         except Error as e:
             print(f"Error getting report: {e}")
+            EVENTS.inc(event='db_error')
             return None
         finally:
             cursor.close()
     
+    @timed(DB_LATENCY, operation='get_recent_reports')
     def get_recent_reports(self, limit=10):
         """Get recent reports"""
         if not self.connection:
@@ -146,6 +194,32 @@ class MySQLDatabase:
             
         except Error as e:
             print(f"Error getting recent reports: {e}")
+            EVENTS.inc(event='db_error')
+            return []
+        finally:
+            cursor.close()
+    
+    @timed(DB_LATENCY, operation='get_image_hashes')
+    def get_image_hashes(self, after_id=0):
+        """(id, image_hash) pairs of hashed reports newer than after_id"""
+        if not self.connection:
+            return []
+        
+        cursor = self.connection.cursor()
+        
+        try:
+            cursor.execute("""
+                SELECT id, image_hash 
+                FROM reports 
+                WHERE image_hash IS NOT NULL AND id > %s 
+                ORDER BY id
+            """, (after_id,))
+            
+            return cursor.fetchall()
+            
+        except Error as e:
+            print(f"Error getting image hashes: {e}")
+            EVENTS.inc(event='db_error')
             return []
         finally:
             cursor.close()
@@ -0,0 +1,58 @@
+"""gunicorn settings for the Flask backend.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master builds the shared RAG index (rag_index.py) once before forking,
+and every worker memory-maps it read-only. Set RAG_SHARED_INDEX=0 to fall
+back to a Chroma collection per worker. Workers write their metrics to
+METRICS_MULTIPROC_DIR so /api/metrics reports the totals of all of them.
+"""
+import os
+import sys
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+# OCR is CPU-bound and capped host-wide, so a few threaded workers are enough
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+# Workers divide MAX_CONCURRENT_OCR and the other admission limits by this (see admission.py)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+# Read by metrics.py, so set before admission (and through it metrics) is imported
+os.environ.setdefault('METRICS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='report-metrics-'))
+
+# gunicorn reads this file before it adds the app directory to sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from admission import lane_capacity  # noqa: E402
+from metrics import registry  # noqa: E402
+
+# Threads let the admission lanes be shared within each worker. Every upload a lane admits, running or
+# queued, holds a thread, so there is one per lane slot plus two for health checks and metric scrapes.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS') or lane_capacity() + 2)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+if os.getenv('RAG_SHARED_INDEX', '1') != '0':
+    # Workers inherit this from the master's environment
+    # Same default as rag_index.DEFAULT_INDEX_PATH
+    os.environ.setdefault('RAG_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_index_data'))
+
+
+def on_starting(server):
+    registry.clear_multiprocess_dir()
+    if threads < lane_capacity():
+        server.log.warning("GUNICORN_THREADS=%d is below the %d uploads the admission lanes admit per worker; "
+                           "uploads beyond it wait for a thread instead of getting a 429", threads, lane_capacity())
+    index_path = os.getenv('RAG_INDEX_PATH')
+    if not index_path:
+        return
+    from rag_index import ensure_index
+    try:
+        ensure_index(index_path)
+        server.log.info("Shared RAG index ready at %s", index_path)
+    except Exception as e:
+        # Workers fall back to their own Chroma collection
+        server.log.warning("Could not build shared RAG index: %s", e)
+        os.environ.pop('RAG_INDEX_PATH', None)
+
+
+def child_exit(server, worker):
+    registry.mark_process_dead(worker.pid)
@@ -62,4 +62,49 @@ MEDICAL_KNOWLEDGE_BASE = [
         "lifestyle_tips": "Avoid alcohol excess, eat foods rich in folate and B12",
         "when_to_worry": "Below 50,000 increases bleeding risk significantly"
     }
-]
\ No newline at end of file
+]
+
+# Numeric limits used to flag parsed values as low or high (None = no limit on that side).
+# Blood pressure is checked separately against systolic/diastolic limits.
+REFERENCE_RANGES = {
+    "hemoglobin": (12.0, 16.0),
+    "glucose": (70.0, 100.0),
+    "cholesterol": (None, 200.0),
+    "creatinine": (0.6, 1.2),
+    "white_blood_cells": (4000.0, 11000.0),
+    "platelets": (150000.0, 450000.0),
+}
+# Matches the knowledge base: "120/80 mmHg or lower" is normal
+BLOOD_PRESSURE_LIMITS = {"systolic": (90, 120), "diastolic": (60, 80)}
+
+
+def classify_value(test_name, value):
+    """Return 'low', 'normal' or 'high' for a parsed lab value, or None if it cannot be judged"""
+    if test_name == "blood_pressure":
+        try:
+            systolic, diastolic = (int(part) for part in str(value).split("/"))
+        except ValueError:
+            return None
+        if systolic > BLOOD_PRESSURE_LIMITS["systolic"][1] or diastolic > BLOOD_PRESSURE_LIMITS["diastolic"][1]:
+            return "high"
+        if systolic < BLOOD_PRESSURE_LIMITS["systolic"][0] or diastolic < BLOOD_PRESSURE_LIMITS["diastolic"][0]:
+            return "low"
+        return "normal"
+
+    if test_name not in REFERENCE_RANGES or not isinstance(value, (int, float)):
+        return None
+    # Cell counts are often printed in thousands (e.g. WBC 7.5, platelets 250),
+    # and Indian reports print platelets in lakhs (e.g. 2.5 lakhs/cumm)
+    if test_name == "white_blood_cells" and value < 100:
+        value *= 1000
+    elif test_name == "platelets" and value < 10:
+        value *= 100000
+    elif test_name == "platelets" and value < 1000:
+        value *= 1000
+
+    low, high = REFERENCE_RANGES[test_name]
+    if low is not None and value < low:
+        return "low"
+    if high is not None and value > high:
+        return "high"
+    return "normal"
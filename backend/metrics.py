@@ -0,0 +1,500 @@
+import os
+import json
+import time
+import atexit
+import random
+import threading
+import functools
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds (seconds) shared by all latency histograms. OCR and LLM calls
+# routinely take several seconds, so the tail buckets go up to a minute.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Directory shared by the worker processes of one server (gunicorn.conf.py sets it). Each process writes
+# its metrics there at most every METRICS_FLUSH_SECONDS, and /api/metrics renders the totals of all of them.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 1))
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        # Set by MetricsRegistry so updates can be written out for the other workers
+        self._on_change = None
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def snapshot(self):
+        """Series as JSON-serializable [labelvalues, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._series.items()]
+
+    def merge(self, totals, series, live):
+        """Add one process's snapshot to totals; live is False once that process has exited"""
+        for key, value in series:
+            key = tuple(key)
+            totals[key] = totals.get(key, 0) + value
+
+    def render(self, series=None):
+        """Exposition lines for this process's series, or for series merged across processes"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        if series is not None:
+            lines.extend(self._render_series(sorted(series.items())))
+            return lines
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(self._render_series(series))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. fallbacks or errors"""
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+        self._changed()
+
+    def init(self, **labels):
+        """Expose a label set at zero before it is first incremented"""
+        key = self._key(labels)
+        with self._lock:
+            self._series.setdefault(key, 0)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, series):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in series]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. queue depth.
+
+    Across worker processes the values of live workers are summed, or with
+    multiprocess_mode='max' the largest is reported (for values every worker
+    reads from the same place).
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), multiprocess_mode='sum'):
+        super().__init__(name, help_text, labelnames)
+        if multiprocess_mode not in ('sum', 'max'):
+            raise ValueError(f"Unknown multiprocess_mode {multiprocess_mode!r}")
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+        self._changed()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+        self._changed()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def merge(self, totals, series, live):
+        # An exited worker's queue depth or slots in use are no longer real
+        if not live:
+            return
+        if self.multiprocess_mode == 'sum':
+            super().merge(totals, series, live)
+            return
+        for key, value in series:
+            key = tuple(key)
+            totals[key] = max(totals[key], value) if key in totals else value
+
+    def _render_series(self, series):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in series]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram in the Prometheus exposition format"""
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+        self._changed()
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), {"counts": list(state["counts"]), "sum": state["sum"], "count": state["count"]}]
+                    for key, state in self._series.items()]
+
+    def merge(self, totals, series, live):
+        for key, state in series:
+            key = tuple(key)
+            total = totals.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            total["counts"] = [a + b for a, b in zip(total["counts"], state["counts"])]
+            total["sum"] += state["sum"]
+            total["count"] += state["count"]
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_series(self, series):
+        lines = []
+        for key, state in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered at /api/metrics.
+
+    Without a multiprocess_dir the metrics are those of this process. With
+    one (METRICS_MULTIPROC_DIR, set by gunicorn.conf.py), every process
+    writes a snapshot named after its pid there, and render adds up the
+    snapshots of all processes, so any worker answers with the totals.
+    Counters and histograms of exited workers are kept so totals never go
+    down; their gauges are dropped.
+    """
+
+    def __init__(self, multiprocess_dir=None, flush_seconds=METRICS_FLUSH_SECONDS):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_seconds = flush_seconds
+        self._dirty = threading.Event()
+        self._flush_lock = threading.Lock()
+        # pid of the process whose flush thread is running; a forked child starts its own
+        self._flusher_pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        if self.multiprocess_dir:
+            metric._on_change = self._changed
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), multiprocess_mode='sum'):
+        return self._register(Gauge(name, help_text, labelnames, multiprocess_mode))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _changed(self):
+        self._dirty.set()
+        if self._flusher_pid != os.getpid():
+            with self._lock:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+                    # Catch the updates of the last flush interval when a worker exits
+                    atexit.register(self.flush)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            self._dirty.wait()
+            self.flush()
+            time.sleep(self.flush_seconds)
+
+    def _write(self, path, snapshot):
+        with self._flush_lock:
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+
+    def flush(self):
+        """Write this process's snapshot for the other workers"""
+        if not self.multiprocess_dir:
+            return
+        self._dirty.clear()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {metric.name: metric.snapshot() for metric in metrics}
+        try:
+            self._write(os.path.join(self.multiprocess_dir, f"{os.getpid()}.json"), snapshot)
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {e}")
+
+    def mark_process_dead(self, pid):
+        """Drop the gauges of an exited worker (gunicorn child_exit), keeping its counters and histograms"""
+        if not self.multiprocess_dir:
+            return
+        path = os.path.join(self.multiprocess_dir, f"{pid}.json")
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            for metric in list(self._metrics.values()):
+                if isinstance(metric, Gauge):
+                    snapshot.pop(metric.name, None)
+            self._write(path, snapshot)
+        except (OSError, ValueError):
+            pass
+
+    def clear_multiprocess_dir(self):
+        """Remove snapshots left by an earlier server, before its workers start (gunicorn on_starting)"""
+        if not self.multiprocess_dir:
+            return
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        for name in os.listdir(self.multiprocess_dir):
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.multiprocess_dir, name))
+                except OSError:
+                    pass
+
+    def _merged(self, metrics):
+        totals = {metric.name: {} for metric in metrics}
+        try:
+            names = os.listdir(self.multiprocess_dir)
+        except OSError as e:
+            print(f"Error reading metrics snapshots: {e}")
+            return None
+        for name in names:
+            pid, ext = os.path.splitext(name)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            live = int(pid) == os.getpid() or _process_alive(int(pid))
+            for metric in metrics:
+                metric.merge(totals[metric.name], snapshot.get(metric.name, ()), live)
+        return totals
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        totals = None
+        if self.multiprocess_dir:
+            self.flush()
+            totals = self._merged(metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(totals[metric.name] if totals is not None else None))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(METRICS_MULTIPROC_DIR)
+
+REQUEST_LATENCY = registry.histogram(
+    "upload_request_duration_seconds",
+    "End-to-end latency of /api/upload requests",
+    ("status",),
+)
+STAGE_LATENCY = registry.histogram(
+    "report_stage_duration_seconds",
+    "Time spent in each stage of the report processing pipeline",
+    ("stage",),
+)
+OCR_PAGE_LATENCY = registry.histogram(
+    "ocr_page_duration_seconds",
+    "Tesseract time per page or image",
+    ("source",),
+)
+DB_LATENCY = registry.histogram(
+    "db_operation_duration_seconds",
+    "Latency of database operations",
+    ("operation",),
+)
+PROMPT_TOKENS = registry.histogram(
+    "llm_prompt_tokens",
+    "Input tokens per explanation prompt (counted locally)",
+    buckets=(100, 200, 300, 400, 600, 800, 1000, 1500, 2000, 4000),
+)
+QUEUE_DEPTH = registry.gauge(
+    "admission_queue_depth",
+    "Uploads waiting for a processing slot in each priority lane",
+    ("lane",),
+)
+LANE_ACTIVE = registry.gauge(
+    "admission_active_requests",
+    "Uploads currently being processed in each priority lane",
+    ("lane",),
+)
+RESOURCE_IN_USE = registry.gauge(
+    "admission_resource_in_use",
+    "Concurrent OCR and LLM calls in flight",
+    ("resource",),
+)
+REJECTIONS = registry.counter(
+    "admission_rejections_total",
+    "Uploads rejected with 429 because a lane was full",
+    ("lane",),
+)
+# Every worker reads these from the same SQLite file
+SYNC_QUEUE = registry.gauge(
+    "offline_sync_queue_reports",
+    "Reports stored locally that have not been pushed to central MySQL yet",
+    multiprocess_mode='max',
+)
+SYNC_LAG = registry.gauge(
+    "offline_sync_lag_seconds",
+    "Age of the oldest report not yet pushed to central MySQL",
+    multiprocess_mode='max',
+)
+EVENTS = registry.counter(
+    "report_events_total",
+    "Cache, fallback and error events in the report pipeline",
+    ("event",),
+)
+
+for _event in ("cache_hit", "cache_miss", "near_duplicate_rejected", "near_duplicate_ambiguous", "llm_fallback",
+               "ocr_error", "llm_error", "rag_error", "db_error", "sync_error", "upload_error"):
+    EVENTS.init(event=_event)
+
+
+def timed(histogram, **labels):
+    """Decorator form of Histogram.time"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestProfiler:
+    """Sampling profiler that dumps cProfile and tracemalloc snapshots for slow requests.
+
+    Disabled unless PROFILE_SAMPLE_RATE is above zero. A sampled request is
+    profiled, and its stats are written to PROFILE_DIR only when it takes
+    longer than PROFILE_SLOW_SECONDS. Only one request is profiled at a time
+    because tracemalloc is process-wide.
+    """
+
+    def __init__(self, sample_rate=None, slow_seconds=None, output_dir=None):
+        self.sample_rate = float(sample_rate if sample_rate is not None else os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.slow_seconds = float(slow_seconds if slow_seconds is not None else os.getenv('PROFILE_SLOW_SECONDS', '5'))
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR', 'profiles')
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled or random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            yield
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            try:
+                if elapsed >= self.slow_seconds:
+                    self._dump(name, elapsed, profiler, tracemalloc.take_snapshot())
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+                self._busy.release()
+
+    def _dump(self, name, elapsed, profiler, snapshot):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stem = os.path.join(self.output_dir, f"{name}-{int(time.time() * 1000)}-{elapsed:.2f}s")
+            profiler.dump_stats(stem + ".prof")
+            snapshot.dump(stem + ".tracemalloc")
+            print(f"Slow request profile written to {stem}.prof ({elapsed:.2f}s)")
+        except OSError as e:
+            print(f"Error writing request profile: {e}")
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,257 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from PIL import Image, ImageOps
+
+# The layout hash covers the first HASH_LINES text lines of a page (the patient header and the top of the
+# results table). Each line is cut into HASH_BINS cells of HASH_CELL line pitches, one bit per inked cell.
+HASH_LINES = 16
+HASH_BINS = 80
+HASH_CELL = 0.25
+HASH_BITS = HASH_LINES * HASH_BINS
+# Pages are hashed at this width; deskewing is searched at a quarter and then half of it
+HASH_WIDTH = 800
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', 24))
+# More stored reports than this within the distance means the hash cannot single one out, so the
+# confirming OCR pass is skipped
+NEAR_DUPLICATE_CANDIDATES = int(os.getenv('NEAR_DUPLICATE_CANDIDATES', 3))
+# How often each worker picks up hashes saved by other workers
+NEAR_DUPLICATE_REFRESH_SECONDS = float(os.getenv('NEAR_DUPLICATE_REFRESH_SECONDS', 30))
+# Lines that identify the patient or the sample, compared before a stored report is reused
+HEADER_LINES = 15
+_IDENTITY_PATTERN = re.compile(
+    r'\b(?:patient|name|id|mrn|uhid|reg(?:istration)?|lab\s*no|sample\s*no|dob|date\s*of\s*birth|age|sex)\b')
+
+
+def _skew_angle(ink, angles):
+    """Angle among angles that makes the row profile sharpest (text lines horizontal)"""
+    best_score, best_angle = None, 0.0
+    for angle in angles:
+        rows = np.asarray(ink.rotate(angle, resample=Image.BILINEAR), dtype=np.float32).sum(axis=1)
+        score = float(np.sum(np.diff(rows) ** 2))
+        if best_score is None or score > best_score:
+            best_score, best_angle = score, angle
+    return best_angle
+
+
+def _text_lines(ink):
+    """(top, bottom) rows of each text line, with specks and split accents dropped or merged"""
+    rows = (ink > 128).sum(axis=1)
+    on = rows > 0.01 * rows.max()
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], on.astype(np.int8), [0]))))
+    runs = list(zip(edges[::2], edges[1::2]))
+    if not runs:
+        return []
+    height = np.median([bottom - top for top, bottom in runs])
+    lines = []
+    for top, bottom in runs:
+        if lines and top - lines[-1][1] < 0.3 * height:
+            lines[-1][1] = bottom
+        else:
+            lines.append([top, bottom])
+    return [(top, bottom) for top, bottom in lines if bottom - top >= 0.5 * height]
+
+
+def _line_pitch(lines):
+    """Distance between consecutive text lines, fitted over the whole page for sub-pixel accuracy"""
+    centers = np.array([(top + bottom) / 2 for top, bottom in lines])
+    step = np.median(np.diff(centers))
+    slots = np.round((centers - centers[0]) / step)
+    return float(np.polyfit(slots, centers, 1)[0])
+
+
+def _left_edge(profile):
+    """Sub-pixel column where the text block starts (half-height crossing, so blur does not move it)"""
+    level = 0.5 * np.median(profile[profile > 0.1 * profile.max()])
+    i = int(np.argmax(profile >= level))
+    if i == 0:
+        return 0.0
+    return i - 1 + (level - profile[i - 1]) / (profile[i] - profile[i - 1])
+
+
+def image_hash(image):
+    """Layout hash of a PIL image of a report page, as a HASH_BITS-bit int, or None without enough text.
+
+    The page is deskewed, and every cell is placed relative to the left edge of
+    the text and measured in line pitches, so another photo of the same page at
+    a different angle, crop, scale or exposure flips only a few bits. Reports
+    on the same template still differ wherever a name or value is longer or
+    shorter.
+    """
+    ink = ImageOps.autocontrast(ImageOps.invert(image.convert('L')))
+    ink.thumbnail((HASH_WIDTH, HASH_WIDTH * 2))
+    coarse = ink.resize((ink.width // 4, ink.height // 4), Image.BOX)
+    angle = _skew_angle(coarse, np.arange(-3, 3.01, 0.5))
+    half = ink.resize((ink.width // 2, ink.height // 2), Image.BOX)
+    angle = _skew_angle(half, np.arange(angle - 0.4, angle + 0.41, 0.1))
+    pixels = np.asarray(ink.rotate(angle, resample=Image.BILINEAR), dtype=np.float32)
+
+    lines = _text_lines(pixels)
+    if len(lines) < 2:
+        return None
+    pitch = _line_pitch(lines)
+    # Faint background (paper texture, JPEG noise) would otherwise fill the gaps between words
+    pixels[pixels <= 64] = 0
+    profiles = [pixels[top:bottom].sum(axis=0) for top, bottom in lines[:HASH_LINES]]
+    left = _left_edge(np.sum(profiles, axis=0))
+    edges = left + np.arange(HASH_BINS + 1) * pitch * HASH_CELL
+
+    value = 0
+    for profile in profiles:
+        cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+        cells = np.diff(np.interp(edges, np.arange(len(cumulative)), cumulative))
+        for inked in cells > 0.2 * cells.max():
+            value = (value << 1) | bool(inked)
+    return value << (HASH_BINS * (HASH_LINES - len(profiles)))
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def format_hash(value):
+    return f"{value:0{HASH_BITS // 4}x}"
+
+
+def parse_hash(text):
+    """Hash stored by format_hash, or None for one written by an older hash function"""
+    if not text or len(text) != HASH_BITS // 4:
+        return None
+    return int(text, 16)
+
+
+def header_fingerprint(text):
+    """Normalized patient/ID lines from the top of a report, or '' if it has none"""
+    lines = []
+    for line in text.lower().splitlines()[:HEADER_LINES]:
+        if _IDENTITY_PATTERN.search(line):
+            normalized = re.sub(r'[^a-z0-9]', '', line)
+            if normalized:
+                lines.append(normalized)
+    return "|".join(lines)
+
+
+def headers_agree(found_text, stored_text):
+    """True when both reports carry the same non-empty patient/ID header"""
+    found = header_fingerprint(found_text)
+    return bool(found) and found == header_fingerprint(stored_text)
+
+
+def values_agree(found, stored):
+    """True when the quick pass read exactly the tests and values of the stored report"""
+    if not found or set(found) != set(stored):
+        return False
+    for test, value in found.items():
+        if isinstance(value, (int, float)) and isinstance(stored[test], (int, float)):
+            if abs(value - stored[test]) > 1e-6:
+                return False
+        elif value != stored[test]:
+            return False
+    return True
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance for fast radius queries"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """All (distance, item) pairs within max_distance, closest first"""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            # Triangle inequality: only subtrees in [d - r, d + r] can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+
+class NearDuplicateIndex:
+    """Layout-hash index of past uploads, backed by the image_hash column of reports.
+
+    The index is filled lazily from the database and refreshed periodically so
+    hashes saved by other workers are found too. Reports printed on the same
+    lab template can hash alike, so a match only proposes candidates: the
+    caller confirms one with headers_agree and values_agree, and only when
+    there are at most max_candidates of them (see confirmable). Disabled when
+    NEAR_DUPLICATE_MAX_DISTANCE is negative.
+    """
+
+    def __init__(self, db, max_distance=None, max_candidates=None, refresh_seconds=None):
+        self.db = db
+        self.max_distance = NEAR_DUPLICATE_MAX_DISTANCE if max_distance is None else max_distance
+        self.max_candidates = NEAR_DUPLICATE_CANDIDATES if max_candidates is None else max_candidates
+        self.refresh_seconds = NEAR_DUPLICATE_REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self._tree = BKTree()
+        self._ids = set()
+        self._last_id = 0
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_distance >= 0
+
+    def _refresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        self._loaded_at = time.monotonic()
+        if not self.db or not hasattr(self.db, 'get_image_hashes'):
+            return
+        for report_id, value in self.db.get_image_hashes(after_id=self._last_id):
+            self._last_id = max(self._last_id, report_id)
+            value = parse_hash(value)
+            if value is not None and report_id not in self._ids:
+                self._ids.add(report_id)
+                self._tree.add(value, report_id)
+
+    def lookup(self, value):
+        """Stored reports within max_distance as (report_id, distance), closest first"""
+        if not self.enabled:
+            return []
+        with self._lock:
+            self._refresh()
+            matches = self._tree.search(value, self.max_distance)
+        return [(report_id, distance) for distance, report_id in matches]
+
+    def confirmable(self, candidates):
+        """True when there are few enough candidates for a confirming OCR pass to be worth it"""
+        return 0 < len(candidates) <= self.max_candidates
+
+    def add(self, value, report_id):
+        if not self.enabled or report_id is None:
+            return
+        with self._lock:
+            # _last_id is left alone so reports saved meanwhile by other workers are still loaded
+            if report_id not in self._ids:
+                self._ids.add(report_id)
+                self._tree.add(value, report_id)
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from metrics import timed, DB_LATENCY, SYNC_QUEUE, SYNC_LAG, EVENTS
+from database import add_report_columns
+
+OFFLINE_DB_PATH = os.getenv('OFFLINE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_reports.db'))
+# Seconds between sync attempts while there is nothing new or the uplink is down
+SYNC_INTERVAL = float(os.getenv('SYNC_INTERVAL', 30))
+# Reports pushed per central transaction
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 50))
+# Every gunicorn worker runs an agent; the one holding the lease syncs, the others take over once it expires
+SYNC_LEASE_SECONDS = float(os.getenv('SYNC_LEASE_SECONDS', 120))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_uuid TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    extracted_text TEXT,
+    lab_values TEXT,
+    explanation TEXT,
+    image_hash TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    synced_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_reports_unsynced ON reports (id) WHERE synced_at IS NULL;
+CREATE TABLE IF NOT EXISTS lab_values (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id INTEGER REFERENCES reports(id),
+    test_name TEXT,
+    test_value REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_lab_values_report_id ON lab_values (report_id);
+CREATE TABLE IF NOT EXISTS sync_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def connect_central():
+    """Connection to the central MySQL database, configured like MySQLDatabase"""
+    import mysql.connector
+    return mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST', 'localhost'),
+        database=os.getenv('MYSQL_DATABASE', 'medical_reports'),
+        user=os.getenv('MYSQL_USER', 'root'),
+        password=os.getenv('MYSQL_PASSWORD', ''),
+        connection_timeout=10
+    )
+
+
+class OfflineFirstDatabase:
+    """Report store with the MySQLDatabase interface that keeps working without an uplink.
+
+    Every report is written to a local SQLite database in WAL mode and gets a
+    client_uuid. A SyncAgent pushes unsent reports to the central MySQL
+    database in the background; local ids are only meaningful on this device.
+    """
+
+    def __init__(self, path=None, connect=connect_central, sync=None, sync_interval=None, batch_size=None):
+        self.path = path or OFFLINE_DB_PATH
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # WAL lets gunicorn workers write while the sync agent reads; NORMAL is durable across app crashes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+        self.sync_agent = None
+        self.refresh_sync_metrics()
+        sync = (os.getenv('OFFLINE_SYNC', '1') != '0') if sync is None else sync
+        if sync:
+            self.sync_agent = SyncAgent(self, connect, sync_interval, batch_size)
+            self.sync_agent.start()
+
+    @timed(DB_LATENCY, operation='save_report')
+    def save_report(self, filename, extracted_text, lab_values, explanation, image_hash=None):
+        """Save report analysis locally; it is pushed to MySQL by the sync agent"""
+        try:
+            with self._lock, self.connection:
+                cursor = self.connection.execute(
+                    "INSERT INTO reports (client_uuid, filename, extracted_text, lab_values, explanation, image_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (str(uuid.uuid4()), filename, extracted_text, json.dumps(lab_values), json.dumps(explanation),
+                     image_hash),
+                )
+                report_id = cursor.lastrowid
+                self.connection.executemany(
+                    "INSERT INTO lab_values (report_id, test_name, test_value) VALUES (?, ?, ?)",
+                    [(report_id, name, value) for name, value in lab_values.items() if isinstance(value, (int, float))],
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving report: {e}")
+            EVENTS.inc(event='db_error')
+            return None
+        SYNC_QUEUE.inc()
+        if self.sync_agent:
+            self.sync_agent.wake()
+        return report_id
+
+    @timed(DB_LATENCY, operation='get_report')
+    def get_report(self, report_id):
+        """Get report by local ID"""
+        try:
+            with self._lock:
+                row = self.connection.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error getting report: {e}")
+            EVENTS.inc(event='db_error')
+            return None
+        if not row:
+            return None
+        report = dict(row)
+        report['lab_values'] = json.loads(report['lab_values'])
+        report['explanation'] = json.loads(report['explanation'])
+        return report
+
+    @timed(DB_LATENCY, operation='get_recent_reports')
+    def get_recent_reports(self, limit=10):
+        """Get recent reports"""
+        try:
+            with self._lock:
+                rows = self.connection.execute(
+                    "SELECT id, filename, created_at, synced_at FROM reports ORDER BY id DESC LIMIT ?", (limit,)
+                ).fetchall()
+            return [dict(row) for row in rows]
+        except sqlite3.Error as e:
+            print(f"Error getting recent reports: {e}")
+            EVENTS.inc(event='db_error')
+            return []
+
+    @timed(DB_LATENCY, operation='get_image_hashes')
+    def get_image_hashes(self, after_id=0):
+        """(id, image_hash) pairs of hashed reports newer than after_id"""
+        try:
+            with self._lock:
+                rows = self.connection.execute(
+                    "SELECT id, image_hash FROM reports WHERE image_hash IS NOT NULL AND id > ? ORDER BY id",
+                    (after_id,),
+                ).fetchall()
+            return [tuple(row) for row in rows]
+        except sqlite3.Error as e:
+            print(f"Error getting image hashes: {e}")
+            EVENTS.inc(event='db_error')
+            return []
+
+    def unsynced_reports(self, limit):
+        """Oldest reports not yet pushed, with their lab values"""
+        with self._lock:
+            reports = [dict(row) for row in self.connection.execute(
+                "SELECT id, client_uuid, filename, extracted_text, lab_values, explanation, image_hash, created_at "
+                "FROM reports WHERE synced_at IS NULL ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()]
+            if not reports:
+                return []
+            placeholders = ",".join("?" * len(reports))
+            lab_rows = self.connection.execute(
+                f"SELECT report_id, test_name, test_value FROM lab_values WHERE report_id IN ({placeholders}) "
+                "ORDER BY id", [report['id'] for report in reports]
+            ).fetchall()
+        by_report = {}
+        for row in lab_rows:
+            by_report.setdefault(row['report_id'], []).append((row['test_name'], row['test_value']))
+        for report in reports:
+            report['lab_value_rows'] = by_report.get(report['id'], [])
+        return reports
+
+    def mark_synced(self, client_uuids):
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE reports SET synced_at = CURRENT_TIMESTAMP WHERE client_uuid = ?",
+                [(client_uuid,) for client_uuid in client_uuids],
+            )
+
+    def claim_sync(self, owner, seconds):
+        """Take or renew the sync lease for owner; False while another agent holds it"""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so two processes cannot both claim a free lease
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT owner, expires_at FROM sync_lease WHERE id = 1").fetchone()
+                if row and row['owner'] != owner and row['expires_at'] > now:
+                    self.connection.rollback()
+                    return False
+                self.connection.execute("INSERT OR REPLACE INTO sync_lease (id, owner, expires_at) VALUES (1, ?, ?)",
+                                        (owner, now + seconds))
+                self.connection.commit()
+                return True
+            except Exception:
+                self.connection.rollback()
+                raise
+
+    def release_sync(self, owner):
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM sync_lease WHERE id = 1 AND owner = ?", (owner,))
+
+    def sync_status(self):
+        """Reports waiting to be pushed and the age in seconds of the oldest one"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*), strftime('%s', 'now') - strftime('%s', MIN(created_at)) "
+                "FROM reports WHERE synced_at IS NULL"
+            ).fetchone()
+        status = {'queue_size': row[0], 'lag_seconds': max(0, row[1] or 0)}
+        if self.sync_agent:
+            status['last_sync'] = self.sync_agent.last_success
+            status['last_error'] = self.sync_agent.last_error
+        return status
+
+    def refresh_sync_metrics(self):
+        try:
+            status = self.sync_status()
+        except sqlite3.Error as e:
+            print(f"Error reading sync status: {e}")
+            EVENTS.inc(event='db_error')
+            return None
+        SYNC_QUEUE.set(status['queue_size'])
+        SYNC_LAG.set(status['lag_seconds'])
+        return status
+
+    def close(self):
+        """Stop syncing and close the local database"""
+        if self.sync_agent:
+            self.sync_agent.stop()
+        self.connection.close()
+
+
+class SyncAgent(threading.Thread):
+    """Background thread that pushes unsent local reports to central MySQL.
+
+    Each batch is one central transaction. Reports are keyed by client_uuid,
+    so a batch that is retried after a dropped connection or a crash before
+    the local rows were marked never creates duplicates. Agents sharing a
+    local database file take turns through a lease in that file, so only one
+    of them pushes at a time. The report columns added after the first
+    release are added to the central table on the first connection.
+    """
+
+    # Central SQL uses the MySQL %s paramstyle
+    INSERT_REPORT = (
+        "INSERT INTO reports (client_uuid, filename, extracted_text, lab_values, explanation, image_hash, created_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE client_uuid = client_uuid"
+    )
+    INSERT_LAB_VALUE = "INSERT INTO lab_values (report_id, test_name, test_value) VALUES (%s, %s, %s)"
+
+    def __init__(self, store, connect=connect_central, interval=None, batch_size=None):
+        super().__init__(name='offline-sync', daemon=True)
+        self.store = store
+        self.connect = connect
+        self.interval = SYNC_INTERVAL if interval is None else interval
+        self.batch_size = SYNC_BATCH_SIZE if batch_size is None else batch_size
+        self.lease_seconds = SYNC_LEASE_SECONDS
+        self.owner = str(uuid.uuid4())
+        self.last_success = None
+        self.last_error = None
+        self._central = None
+        self._migrated = False
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout=10)
+        self._disconnect()
+        try:
+            self.store.release_sync(self.owner)
+        except sqlite3.Error as e:
+            print(f"Error releasing sync lease: {e}")
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error syncing reports: {e}")
+                EVENTS.inc(event='sync_error')
+                self._disconnect()
+            self.store.refresh_sync_metrics()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _disconnect(self):
+        if self._central is not None:
+            try:
+                self._central.close()
+            except Exception:
+                pass
+            self._central = None
+
+    def _connect(self):
+        self._central = self.connect()
+        if not self._migrated:
+            self._migrated = add_report_columns(self._central)
+
+    def sync_once(self):
+        """Push every unsent report in batches; returns how many were pushed"""
+        pushed = 0
+        while not self._stopped.is_set():
+            reports = self.store.unsynced_reports(self.batch_size)
+            if not reports:
+                break
+            # Renewed per batch; another agent holding the lease leaves this one idle
+            if not self.store.claim_sync(self.owner, self.lease_seconds):
+                break
+            if self._central is None:
+                self._connect()
+            self._push_batch(reports)
+            self.store.mark_synced([report['client_uuid'] for report in reports])
+            pushed += len(reports)
+            self.last_success = time.time()
+            self.last_error = None
+        return pushed
+
+    def _push_batch(self, reports):
+        cursor = self._central.cursor()
+        try:
+            cursor.executemany(self.INSERT_REPORT, [
+                (report['client_uuid'], report['filename'], report['extracted_text'], report['lab_values'],
+                 report['explanation'], report['image_hash'], report['created_at'])
+                for report in reports
+            ])
+            placeholders = ",".join(["%s"] * len(reports))
+            cursor.execute(f"SELECT id, client_uuid FROM reports WHERE client_uuid IN ({placeholders})",
+                           [report['client_uuid'] for report in reports])
+            central_ids = {client_uuid: report_id for report_id, client_uuid in cursor.fetchall()}
+
+            # Replace rather than append lab values, so a retried batch leaves one copy
+            ids = [central_ids[report['client_uuid']] for report in reports]
+            cursor.execute(f"DELETE FROM lab_values WHERE report_id IN ({placeholders})", ids)
+            rows = [(central_ids[report['client_uuid']], name, value)
+                    for report in reports for name, value in report['lab_value_rows']]
+            if rows:
+                cursor.executemany(self.INSERT_LAB_VALUE, rows)
+            self._central.commit()
+        except Exception:
+            try:
+                self._central.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
@@ -0,0 +1,83 @@
+import os
+import json
+import threading
+from medical_knowledge import MEDICAL_KNOWLEDGE_BASE
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales', 'phrases.json')
+
+
+class PhraseCatalog:
+    """Precomputed, versioned phrase catalog for patient-facing text.
+
+    All translations ship in locales/phrases.json, so localized explanations
+    are assembled locally with no LLM round trip. On load every phrase key is
+    mapped to a slot number and each language becomes one tuple indexed by
+    slot, with missing entries filled from the default language.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.version = data['version']
+        self.default_language = data['default_language']
+        self.languages = data['languages']
+
+        phrases = data['phrases']
+        # English knowledge-base text comes straight from MEDICAL_KNOWLEDGE_BASE
+        for item in MEDICAL_KNOWLEDGE_BASE:
+            for field in ('description', 'lifestyle_tips'):
+                phrases.setdefault(f"kb.{item['test']}.{field}", {})[self.default_language] = item[field]
+
+        self._slots = {key: i for i, key in enumerate(sorted(phrases))}
+        default = [self._freeze(phrases[key].get(self.default_language)) for key in sorted(phrases)]
+        self._table = {}
+        for lang in self.languages:
+            self._table[lang] = tuple(
+                self._freeze(phrases[key].get(lang)) if lang in phrases[key] else default[i]
+                for i, key in enumerate(sorted(phrases))
+            )
+
+    @staticmethod
+    def _freeze(value):
+        return tuple(value) if isinstance(value, list) else value
+
+    def resolve_language(self, lang):
+        """Map a requested language code (e.g. 'hi', 'hi-IN') to a supported one"""
+        if lang:
+            code = str(lang).lower().replace('_', '-').split('-')[0]
+            if code in self._table:
+                return code
+        return self.default_language
+
+    def has(self, key):
+        return key in self._slots
+
+    def get(self, key, lang, default=None, **values):
+        """Look up a phrase, formatting {placeholders} when values are given"""
+        slot = self._slots.get(key)
+        if slot is None:
+            return default
+        phrase = self._table[self.resolve_language(lang)][slot]
+        if phrase is None:
+            return default
+        if isinstance(phrase, tuple):
+            return list(phrase)
+        return phrase.format(**values) if values else phrase
+
+    def test_name(self, test, lang):
+        return self.get(f"test.{test}", lang, default=test.replace('_', ' '))
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Load the catalog once per process"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = PhraseCatalog()
+    return _catalog
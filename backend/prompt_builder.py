@@ -0,0 +1,166 @@
+import os
+import re
+import json
+from medical_knowledge import MEDICAL_KNOWLEDGE_BASE, classify_value
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MODEL_NAME = "gpt-3.5-turbo"
+CONTEXT_WINDOW = 16385
+MAX_OUTPUT_TOKENS = 1000
+# Input budget for the prompt; the context window minus max_tokens is the hard ceiling
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 900))
+# Chat formatting overhead per message (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 8
+
+INSTRUCTIONS = """You are a medical assistant helping rural patients understand their lab reports.
+Using the medical context below, explain each test in simple language, compare values to normal ranges,
+give lifestyle suggestions (NO diagnosis/medication) and rate overall risk as Low, Medium or High.
+Return JSON: {"summary": "", "test_explanations": {}, "lifestyle_tips": [], "when_to_see_doctor": "", "risk_level": "Low/Medium/High"}"""
+
+_KB_BY_TEST = {item['test']: item for item in MEDICAL_KNOWLEDGE_BASE}
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+_LINE_KEYWORDS = {
+    'hemoglobin': ('hemoglobin', 'hb', 'hgb'),
+    'glucose': ('glucose', 'sugar', 'fbs'),
+    'cholesterol': ('cholesterol', 'chol'),
+    'creatinine': ('creatinine', 'creat'),
+    'white_blood_cells': ('wbc', 'white'),
+    'platelets': ('platelet', 'plt'),
+    'blood_pressure': ('bp', 'blood pressure'),
+    'hypertension': ('hypertension',),
+    'chest_pain': ('chest',),
+    'palpitations': ('palpitation',),
+    'shortness_of_breath': ('breath',),
+}
+
+# Keywords match whole words (plural allowed), so 'hb' does not pick up HbA1c lines
+_LINE_PATTERNS = {test: re.compile(r'\b(?:' + '|'.join(map(re.escape, keywords)) + r')s?\b')
+                  for test, keywords in _LINE_KEYWORDS.items()}
+
+_encoding = None
+# Set when the encoding could not be loaded (tiktoken downloads it on first use), so it is not retried
+_ENCODING_UNAVAILABLE = object()
+
+
+def count_tokens(text):
+    """Count tokens locally with tiktoken, or estimate from word pieces when it is unavailable"""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(MODEL_NAME)
+        except Exception as e:
+            print(f"tiktoken encoding unavailable, estimating prompt tokens: {e}")
+            _encoding = _ENCODING_UNAVAILABLE
+    if _encoding is not None and _encoding is not _ENCODING_UNAVAILABLE:
+        return len(_encoding.encode(text))
+    # Roughly one token per 4 characters of a word, and one per punctuation mark
+    return sum((len(piece) + 3) // 4 for piece in _WORD_PATTERN.findall(text))
+
+
+def _format_value(test, value):
+    status = classify_value(test, value)
+    flag = f" ({status.upper()})" if status in ('low', 'high') else ""
+    return f"{test}={value}{flag}"
+
+
+def _format_kb(item, status=None):
+    if status == 'normal':
+        # In-range tests only need the range to be explained; the full entry is kept for flagged ones
+        return f"{item['test']}: Normal: {item['normal_range']}."
+    line = f"{item['test']}: {item['description']}. Normal: {item['normal_range']}. Tips: {item['lifestyle_tips']}"
+    if status == 'high' and item.get('high_causes'):
+        line += f" High causes: {item['high_causes']}."
+    elif status == 'low' and item.get('low_causes'):
+        line += f" Low causes: {item['low_causes']}."
+    return line
+
+
+def _relevant_lines(extracted_text, tests):
+    """Report lines that mention a parsed test, in test priority order, de-duplicated"""
+    lines = []
+    seen = set()
+    normalized = [" ".join(line.split()) for line in extracted_text.splitlines()]
+    for test in tests:
+        pattern = _LINE_PATTERNS.get(test) or re.compile(r'\b' + re.escape(test.replace('_', ' ')) + r's?\b')
+        for line in normalized:
+            lowered = line.lower()
+            if line and lowered not in seen and pattern.search(lowered):
+                seen.add(lowered)
+                lines.append(line)
+    return lines
+
+
+def build_prompt(lab_values, extracted_text, rag_context=None, max_tokens=MAX_OUTPUT_TOKENS, budget=None):
+    """Build the explanation prompt within a token budget.
+
+    Content is admitted in priority order until the budget is spent:
+    out-of-range analytes, the remaining analytes, knowledge-base entries
+    (de-duplicated, out-of-range tests first, in-range tests reduced to
+    their normal range) and finally report lines that mention an
+    out-of-range test. Space for max_tokens of output is always kept.
+    Returns (prompt, stats).
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    budget = min(budget, CONTEXT_WINDOW - max_tokens - MESSAGE_OVERHEAD_TOKENS)
+    used = count_tokens(INSTRUCTIONS) + 3 * 4  # instructions plus the three section headers
+
+    statuses = {test: classify_value(test, value) for test, value in lab_values.items()}
+    abnormal = [test for test in lab_values if statuses[test] in ('low', 'high')]
+    others = [test for test in lab_values if test not in abnormal]
+
+    sections = {'values': [], 'context': [], 'report': []}
+    stats = {'dropped': 0, 'abnormal_total': len(abnormal), 'abnormal_included': 0}
+
+    def admit(section, text):
+        nonlocal used
+        cost = count_tokens(text) + 1
+        if used + cost > budget:
+            stats['dropped'] += 1
+            return False
+        sections[section].append(text)
+        used += cost
+        return True
+
+    for test in abnormal:
+        if admit('values', _format_value(test, lab_values[test])):
+            stats['abnormal_included'] += 1
+    for test in others:
+        admit('values', _format_value(test, lab_values[test]))
+
+    # Knowledge base: parsed tests first (out-of-range before the rest), then any other retrieved entries
+    kb_items = []
+    seen_tests = set()
+    retrieved = {item.get('test'): item for item in (rag_context or []) if item.get('test')}
+    for test in abnormal + others + list(retrieved):
+        item = retrieved.get(test) or _KB_BY_TEST.get(test)
+        if item and test not in seen_tests:
+            seen_tests.add(test)
+            kb_items.append((item, statuses.get(test)))
+    for item, status in kb_items:
+        admit('context', _format_kb(item, status))
+
+    # With nothing parsed, the raw report is all the model has to go on
+    if lab_values:
+        # Only flagged tests need the lab's own reference range; in-range values are already listed
+        report_lines = _relevant_lines(extracted_text, abnormal)
+    else:
+        report_lines = [" ".join(line.split()) for line in extracted_text.splitlines() if line.strip()]
+    for line in report_lines:
+        if not admit('report', line) and not lab_values:
+            break
+
+    prompt = "\n".join([
+        INSTRUCTIONS,
+        "MEDICAL CONTEXT:",
+        *(sections['context'] or ["Basic medical knowledge available."]),
+        "PATIENT'S LAB VALUES: " + (", ".join(sections['values']) or json.dumps(lab_values)),
+        "REPORT LINES:",
+        *sections['report'],
+    ])
+    stats['prompt_tokens'] = count_tokens(prompt)
+    stats['budget'] = budget
+    return prompt, stats
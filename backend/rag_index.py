@@ -0,0 +1,179 @@
+"""Read-only knowledge-base index shared by all gunicorn workers.
+
+The knowledge-base embeddings are written once to a .npy file that every
+worker memory-maps read-only, so the pages are shared through the page cache
+instead of each worker holding its own Chroma client, embedding model and
+copy of the vectors. Next to it, index.json holds the documents and, for
+every test name the parser produces, the knowledge-base rows ranked by
+similarity, so the common queries need no embedding model at all.
+
+Build it ahead of time (gunicorn.conf.py does this in the master):
+
+    python -m rag_index build --path rag_index_data
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+import threading
+import numpy as np
+from medical_knowledge import MEDICAL_KNOWLEDGE_BASE
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_index_data')
+# "module:attribute" of the embedding function class; empty means Chroma's default model
+EMBEDDING_FUNCTION = os.getenv('RAG_EMBEDDING_FUNCTION', '')
+# Knowledge-base rows stored per test name
+NEIGHBOURS = 5
+
+# Every key _parse_lab_values can produce
+INDEXED_TESTS = (
+    'hemoglobin', 'glucose', 'cholesterol', 'creatinine', 'white_blood_cells', 'platelets',
+    'blood_pressure', 'hypertension', 'chest_pain', 'palpitations', 'shortness_of_breath',
+)
+
+
+def document_text(item):
+    return f"{item['test']}: {item['description']}. Normal: {item['normal_range']}. Tips: {item['lifestyle_tips']}"
+
+
+def load_embedding_function(spec=None):
+    spec = EMBEDDING_FUNCTION if spec is None else spec
+    if not spec:
+        from chromadb.utils import embedding_functions
+        return embedding_functions.DefaultEmbeddingFunction()
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def kb_fingerprint(knowledge_base=MEDICAL_KNOWLEDGE_BASE):
+    payload = json.dumps([knowledge_base, INDEXED_TESTS], sort_keys=True).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'index.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(path, embedding_spec=None):
+    """True when the artifact at path matches this knowledge base and embedding function"""
+    meta = _read_meta(path)
+    return bool(meta and meta.get('version') == INDEX_VERSION
+                and meta.get('kb_fingerprint') == kb_fingerprint()
+                and meta.get('embedding_function') == (EMBEDDING_FUNCTION if embedding_spec is None else embedding_spec))
+
+
+def build_index(path, embedding_spec=None, knowledge_base=MEDICAL_KNOWLEDGE_BASE):
+    """Embed the knowledge base and write embeddings.npy and index.json under path"""
+    embedding_spec = EMBEDDING_FUNCTION if embedding_spec is None else embedding_spec
+    embed = load_embedding_function(embedding_spec)
+    documents = [document_text(item) for item in knowledge_base]
+    embeddings = _normalize(embed(documents))
+
+    # Rank the knowledge base once for every test name, with the query the RAG lookup uses
+    query_vectors = _normalize(embed([f"{test} lab test" for test in INDEXED_TESTS]))
+    scores = query_vectors @ embeddings.T
+    # A knowledge-base entry for the test itself always ranks first
+    for i, test in enumerate(INDEXED_TESTS):
+        for row, item in enumerate(knowledge_base):
+            if item['test'] == test:
+                scores[i, row] = np.inf
+    tests = {test: [int(row) for row in np.argsort(-scores[i])[:NEIGHBOURS]]
+             for i, test in enumerate(INDEXED_TESTS)}
+
+    os.makedirs(path, exist_ok=True)
+    # Write to temporary names and rename, so running workers never map a half-written file
+    embeddings_path = os.path.join(path, 'embeddings.npy')
+    np.save(embeddings_path + '.tmp.npy', embeddings)
+    os.replace(embeddings_path + '.tmp.npy', embeddings_path)
+    meta = {
+        'version': INDEX_VERSION,
+        'kb_fingerprint': kb_fingerprint(knowledge_base),
+        'embedding_function': embedding_spec,
+        'dimensions': int(embeddings.shape[1]),
+        'metadatas': knowledge_base,
+        'tests': tests,
+    }
+    meta_path = os.path.join(path, 'index.json')
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return path
+
+
+def ensure_index(path, embedding_spec=None):
+    """Build the artifact unless an up-to-date one is already there.
+
+    The build runs in a child process so the embedding model is never loaded
+    into the caller (the gunicorn master), whose memory every worker inherits.
+    """
+    if is_current(path, embedding_spec):
+        return path
+    import subprocess
+    spec = EMBEDDING_FUNCTION if embedding_spec is None else embedding_spec
+    subprocess.run([sys.executable, '-m', 'rag_index', 'build', '--path', path, '--embedding-function', spec],
+                   check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return path
+
+
+class SharedRAGIndex:
+    """Memory-mapped, read-only view of an artifact written by build_index"""
+
+    def __init__(self, path):
+        meta = _read_meta(path)
+        if not meta or meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"No RAG index at {path}")
+        if meta['kb_fingerprint'] != kb_fingerprint():
+            raise ValueError(f"RAG index at {path} was built from a different knowledge base")
+        self.path = path
+        self.metadatas = meta['metadatas']
+        self.tests = meta['tests']
+        self.embedding_spec = meta['embedding_function']
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        self._embed = None
+        self._embed_lock = threading.Lock()
+
+    def neighbours(self, test_name, top_k=2):
+        """Knowledge-base entries for a parsed test, or None if the test is not indexed"""
+        rows = self.tests.get(test_name)
+        if rows is None:
+            return None
+        return [self.metadatas[row] for row in rows[:top_k]]
+
+    def query(self, text, top_k=3):
+        """Free-text similarity search; loads the embedding model on first use"""
+        with self._embed_lock:
+            if self._embed is None:
+                self._embed = load_embedding_function(self.embedding_spec)
+        vector = _normalize(self._embed([text]))[0]
+        scores = self.embeddings @ vector
+        return [self.metadatas[int(row)] for row in np.argsort(-scores)[:top_k]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--path', default=os.getenv('RAG_INDEX_PATH') or DEFAULT_INDEX_PATH)
+    parser.add_argument('--embedding-function', default=EMBEDDING_FUNCTION,
+                        help='module:attribute of the embedding function (default: Chroma default model)')
+    args = parser.parse_args(argv)
+    build_index(args.path, args.embedding_function)
+    print(f"RAG index written to {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
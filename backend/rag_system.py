@@ -1,15 +1,38 @@
-import chromadb
+import os
 from medical_knowledge import MEDICAL_KNOWLEDGE_BASE
+from rag_index import SharedRAGIndex, load_embedding_function, EMBEDDING_FUNCTION
+from metrics import EVENTS
 
 class MedicalRAGSystem:
-    def __init__(self):
+    def __init__(self, embedding_function=None, index_path=None):
+        self.index = None
+        index_path = index_path or os.getenv('RAG_INDEX_PATH')
+        if index_path:
+            # Shared memory-mapped index (see rag_index.py); no Chroma client in this process
+            try:
+                self.index = SharedRAGIndex(index_path)
+                self.collection = None
+                self.knowledge_base = MEDICAL_KNOWLEDGE_BASE
+                return
+            except Exception as e:
+                print(f"RAG index error: {e}")
+                EVENTS.inc(event='rag_error')
+        
         try:
+            # Imported here so workers using the shared index never load Chroma
+            import chromadb
             self.client = chromadb.Client()
-            self.collection = self.client.get_or_create_collection("medical_knowledge")
+            if embedding_function is None and EMBEDDING_FUNCTION:
+                embedding_function = load_embedding_function()
+            if embedding_function is not None:
+                self.collection = self.client.get_or_create_collection("medical_knowledge", embedding_function=embedding_function)
+            else:
+                self.collection = self.client.get_or_create_collection("medical_knowledge")
             self.knowledge_base = MEDICAL_KNOWLEDGE_BASE
             self._populate_collection()
         except Exception as e:
             print(f"ChromaDB error: {e}")
+            EVENTS.inc(event='rag_error')
             self.collection = None
             self.knowledge_base = MEDICAL_KNOWLEDGE_BASE
     
@@ -35,8 +58,17 @@ class MedicalRAGSystem:
             )
         except Exception as e:
             print(f"ChromaDB populate error: {e}")
+            EVENTS.inc(event='rag_error')
     
     def retrieve_relevant_info(self, query, top_k=3):
+        if self.index:
+            try:
+                return self.index.query(query, top_k)
+            except Exception as e:
+                print(f"RAG index query error: {e}")
+                EVENTS.inc(event='rag_error')
+                return []
+        
         if not self.collection:
             return [item for item in self.knowledge_base[:top_k]]
         
@@ -48,14 +80,18 @@ class MedicalRAGSystem:
             return results['metadatas'][0] if results['metadatas'] else []
         except Exception as e:
             print(f"ChromaDB query error: {e}")
+            EVENTS.inc(event='rag_error')
             return []
     
     def generate_rag_context(self, lab_values, extracted_text):
         context_info = []
         
         for test_name, value in lab_values.items():
-            query = f"{test_name} lab test {value}"
-            relevant_docs = self.retrieve_relevant_info(query, top_k=2)
+            # Parsed test names are pre-ranked in the shared index
+            relevant_docs = self.index.neighbours(test_name, top_k=2) if self.index else None
+            if relevant_docs is None:
+                query = f"{test_name} lab test {value}"
+                relevant_docs = self.retrieve_relevant_info(query, top_k=2)
             context_info.extend(relevant_docs)
         
         return context_info[:5] if context_info else self.knowledge_base[:3]
\ No newline at end of file
@@ -4,6 +4,7 @@ import mysql.connector
 from mysql.connector import Error
 import os
 from dotenv import load_dotenv
+from database import add_report_columns
 
 load_dotenv()
 
@@ -41,6 +42,8 @@ def setup_database():
             extracted_text TEXT,
             lab_values JSON,
             explanation JSON,
+            image_hash VARCHAR(320) NULL,
+            client_uuid CHAR(36) NULL UNIQUE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             INDEX idx_created_at (created_at)
         )
@@ -66,6 +69,8 @@ def setup_database():
         cursor.execute(lab_values_table)
         
         connection.commit()
+        # Tables created by an earlier release
+        add_report_columns(connection)
         print("✅ Tables created successfully")
         
         # Show table structure
@@ -1,9 +1,9 @@
 import streamlit as st
 import os
-import tempfile
 import pandas as pd
 import plotly.graph_objects as go
 from app import MedicalReportProcessor, rag_system, db
+from phrase_catalog import get_catalog
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -61,6 +61,13 @@ with st.sidebar:
     st.markdown("### Simplifier for Rural Patients")
     st.info("Upload your medical lab report to get a simple, easy-to-understand explanation in your local language context.")
     
+    catalog = get_catalog()
+    language = st.selectbox(
+        "Explanation language",
+        options=list(catalog.languages),
+        format_func=lambda code: catalog.languages[code]
+    )
+    
     st.markdown("---")
     st.markdown("### Features")
     st.markdown("✅ OCR Text Extraction")
@@ -78,11 +85,9 @@ with dashboard_tab:
 
     if uploaded_file is not None:
         try:
-            # Save temp file
+            # Process the upload from memory; no temp file to write or clean up
             suffix = os.path.splitext(uploaded_file.name)[1]
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            file_bytes = uploaded_file.getvalue()
 
             col1, col2 = st.columns([1, 1])
 
@@ -96,18 +101,15 @@ with dashboard_tab:
             with st.spinner('Analyzing report... This may take a moment.'):
                 # Process File
                 if suffix.lower() == '.pdf':
-                    extracted_text = processor.extract_text_from_pdf(tmp_path)
+                    extracted_text = processor.extract_text_from_pdf(file_bytes)
                 else:
-                    extracted_text = processor.extract_text_from_image(tmp_path)
-
-                # Cleanup
-                os.unlink(tmp_path)
+                    extracted_text = processor.extract_text_from_image(file_bytes)
                 
                 # Parse Values
                 lab_values = processor.parse_lab_values(extracted_text)
                 
                 # Generate Explanation
-                explanation = processor.generate_explanation_with_rag(lab_values, extracted_text)
+                explanation = processor.generate_explanation_with_rag(lab_values, extracted_text, language)
 
             # --- Results Display ---
             st.success("Analysis Complete!")
@@ -0,0 +1,51 @@
+import pytest
+
+from medical_knowledge import classify_value
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("120/80", "normal"),
+    ("110/70", "normal"),
+    ("121/80", "high"),
+    ("120/81", "high"),
+    ("140/90", "high"),
+    ("85/60", "low"),
+    ("110/55", "low"),
+    ("abc", None),
+])
+def test_blood_pressure(value, expected):
+    assert classify_value("blood_pressure", value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (250000.0, "normal"),
+    (250.0, "normal"),      # thousands per mcL
+    (2.5, "normal"),        # lakhs/cumm
+    (1.2, "low"),
+    (100.0, "low"),
+    (5.0, "high"),
+    (500000.0, "high"),
+])
+def test_platelet_scales(value, expected):
+    assert classify_value("platelets", value) == expected
+
+
+@pytest.mark.parametrize("test_name, value, expected", [
+    ("white_blood_cells", 7.5, "normal"),
+    ("white_blood_cells", 7500.0, "normal"),
+    ("white_blood_cells", 12.0, "high"),
+    ("hemoglobin", 11.0, "low"),
+    ("hemoglobin", 16.0, "normal"),
+    ("glucose", 126.0, "high"),
+    ("cholesterol", 150.0, "normal"),
+    ("cholesterol", 240.0, "high"),
+    ("creatinine", 0.4, "low"),
+])
+def test_reference_ranges(test_name, value, expected):
+    assert classify_value(test_name, value) == expected
+
+
+def test_unjudgeable_values():
+    assert classify_value("hypertension", "present") is None
+    assert classify_value("glucose", "present") is None
+    assert classify_value("unknown_test", 5.0) is None
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+
+from metrics import MetricsRegistry
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def _registry(directory):
+    registry = MetricsRegistry(str(directory))
+    counter = registry.counter('events_total', 'Events', ('event',))
+    depth = registry.gauge('queue_depth', 'Queue depth')
+    lag = registry.gauge('sync_lag_seconds', 'Sync lag', multiprocess_mode='max')
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(1.0,))
+    return registry, counter, depth, lag, latency
+
+
+def _write_snapshot(directory, pid, snapshot):
+    with open(os.path.join(directory, f"{pid}.json"), 'w') as f:
+        json.dump(snapshot, f)
+
+
+def test_render_adds_up_all_workers(tmp_path):
+    registry, counter, depth, lag, latency = _registry(tmp_path)
+    counter.inc(event='hit')
+    depth.set(2)
+    lag.set(30)
+    latency.observe(0.5)
+    # Another live worker; this test's parent process stands in for it
+    _write_snapshot(tmp_path, os.getppid(), {
+        'events_total': [[['hit'], 3]],
+        'queue_depth': [[[], 1]],
+        'sync_lag_seconds': [[[], 10]],
+        'latency_seconds': [[[], {'counts': [0, 1], 'sum': 4.0, 'count': 1}]],
+    })
+    lines = registry.render().splitlines()
+    assert 'events_total{event="hit"} 4' in lines
+    assert 'queue_depth 3' in lines
+    assert 'sync_lag_seconds 30' in lines
+    assert 'latency_seconds_bucket{le="1"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'latency_seconds_count 2' in lines
+
+
+def test_exited_workers_keep_counters_but_not_gauges(tmp_path):
+    registry, counter, depth, _, _ = _registry(tmp_path)
+    counter.inc(event='hit')
+    depth.set(2)
+    _write_snapshot(tmp_path, _exited_pid(), {'events_total': [[['hit'], 5]], 'queue_depth': [[[], 7]]})
+    lines = registry.render().splitlines()
+    assert 'events_total{event="hit"} 6' in lines
+    assert 'queue_depth 2' in lines
+
+
+def test_mark_process_dead_drops_gauges(tmp_path):
+    registry = _registry(tmp_path)[0]
+    pid = os.getppid()
+    _write_snapshot(tmp_path, pid, {'events_total': [[['hit'], 5]], 'queue_depth': [[[], 7]]})
+    registry.mark_process_dead(pid)
+    with open(tmp_path / f"{pid}.json") as f:
+        assert json.load(f) == {'events_total': [[['hit'], 5]]}
@@ -0,0 +1,45 @@
+import io
+from PIL import Image
+
+from benchmarks.synthetic_reports import generate_report, generate_same_template_corpus, rephotograph
+from near_duplicate import (NEAR_DUPLICATE_MAX_DISTANCE, NearDuplicateIndex, format_hash, hamming_distance,
+                            image_hash, parse_hash)
+
+
+def _hash(report):
+    return image_hash(Image.open(io.BytesIO(report.data)))
+
+
+def test_rephotographed_report_stays_within_distance():
+    report = generate_same_template_corpus(1)[0]
+    original = _hash(report)
+    for seed in range(3):
+        assert hamming_distance(original, _hash(rephotograph(report, seed=seed))) <= NEAR_DUPLICATE_MAX_DISTANCE
+
+
+def test_other_layouts_are_far_apart():
+    short = generate_report(seed=1, analytes=['hemoglobin', 'glucose'])
+    full = generate_same_template_corpus(1)[0]
+    assert hamming_distance(_hash(short), _hash(full)) > 3 * NEAR_DUPLICATE_MAX_DISTANCE
+
+
+def test_blank_page_has_no_hash():
+    assert image_hash(Image.new('L', (800, 1100), 255)) is None
+
+
+def test_hashes_from_the_old_64_bit_format_are_ignored():
+    value = _hash(generate_same_template_corpus(1)[0])
+    assert parse_hash(format_hash(value)) == value
+    assert parse_hash('00ff00ff00ff00ff') is None
+
+
+def test_confirming_pass_needs_few_candidates():
+    index = NearDuplicateIndex(None, max_distance=2, max_candidates=2)
+    for report_id in range(3):
+        index.add(1 << report_id, report_id)
+    assert index.lookup(0b111 << 10) == []
+    assert index.confirmable([]) is False
+    assert [report_id for report_id, _ in index.lookup(1)] == [0, 1, 2]
+    assert index.confirmable(index.lookup(1)) is False
+    assert index.lookup((1 << 10) | 1) == [(0, 1)]
+    assert index.confirmable(index.lookup((1 << 10) | 1)) is True
@@ -0,0 +1,87 @@
+import pytest
+
+from offline_store import OfflineFirstDatabase, SyncAgent
+from benchmarks.fakes import FakeCentralMySQL
+
+LAB_VALUES = {'glucose': 95.0, 'hemoglobin': 12.5, 'blood_pressure': '120/80'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = OfflineFirstDatabase(str(tmp_path / 'offline.db'), sync=False)
+    yield store
+    store.close()
+
+
+def save_reports(store, count):
+    for i in range(count):
+        store.save_report(f"report-{i}.png", f"Patient: Test Patient {i}", LAB_VALUES, {'summary': 'ok'})
+
+
+def test_retry_after_dropped_connection_creates_no_duplicates(store):
+    central = FakeCentralMySQL()
+    agent = SyncAgent(store, central.connect, batch_size=3)
+    save_reports(store, 5)
+
+    # Two migration statements and four per batch: drop the connection after the second batch's reports
+    central.fail_after = central.statements + 8
+    with pytest.raises(ConnectionError):
+        agent.sync_once()
+    assert store.sync_status()['queue_size'] == 2
+
+    central.fail_after = None
+    agent._disconnect()
+    assert agent.sync_once() == 2
+    assert store.sync_status()['queue_size'] == 0
+    assert central.count('reports') == 5
+    # Two numeric values per report, pushed once
+    assert central.count('lab_values') == 10
+
+
+def test_repush_after_crash_before_marking_creates_no_duplicates(store):
+    central = FakeCentralMySQL()
+    agent = SyncAgent(store, central.connect)
+    save_reports(store, 4)
+    agent.sync_once()
+
+    # As if the process died after the central commit but before the local rows were marked
+    with store.connection:
+        store.connection.execute("UPDATE reports SET synced_at = NULL")
+    assert agent.sync_once() == 4
+    assert central.count('reports') == 4
+    assert central.count('lab_values') == 8
+
+
+def test_adds_missing_columns_to_central_table(store):
+    central = FakeCentralMySQL(legacy_schema=True)
+    agent = SyncAgent(store, central.connect)
+    save_reports(store, 2)
+
+    assert agent.sync_once() == 2
+    assert {'client_uuid', 'image_hash'} <= set(central.columns('reports'))
+    assert central.count('reports') == 2
+
+
+def test_only_one_agent_per_database_file_syncs(tmp_path):
+    path = str(tmp_path / 'offline.db')
+    first = OfflineFirstDatabase(path, sync=False)
+    second = OfflineFirstDatabase(path, sync=False)
+    central = FakeCentralMySQL()
+    first_agent = SyncAgent(first, central.connect)
+    second_agent = SyncAgent(second, central.connect)
+    try:
+        save_reports(first, 1)
+        assert first_agent.sync_once() == 1
+
+        save_reports(second, 1)
+        assert second_agent.sync_once() == 0
+        assert first_agent.sync_once() == 1
+
+        # The lease is free again once its holder stops
+        first_agent.stop()
+        save_reports(second, 1)
+        assert second_agent.sync_once() == 1
+        assert central.count('reports') == 3
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,23 @@
+from prompt_builder import build_prompt, _relevant_lines
+
+REPORT = """Patient: Test Patient 1
+HbA1c 6.1 %
+Hemoglobin 10.2 g/dL 12-16
+Glucose 95 mg/dL 70-100"""
+
+
+def test_report_lines_match_whole_words():
+    assert _relevant_lines(REPORT, ['hemoglobin']) == ['Hemoglobin 10.2 g/dL 12-16']
+
+
+def test_only_out_of_range_report_lines_are_added():
+    prompt, _ = build_prompt({'hemoglobin': 10.2, 'glucose': 95.0}, REPORT, [])
+    report_section = prompt.split("REPORT LINES:")[1]
+    assert 'Hemoglobin 10.2' in report_section
+    assert 'Glucose' not in report_section
+
+
+def test_explicit_zero_budget_is_not_the_default():
+    _, stats = build_prompt({'hemoglobin': 10.2}, REPORT, [], budget=0)
+    assert stats['budget'] == 0
+    assert stats['abnormal_included'] == 0